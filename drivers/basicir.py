@@ -18,14 +18,21 @@ Base IR driver, most of the time, this is what you need.
 """
 
 from null import driverNull
-import requests
 import base64
 import json
 from modules.commandtype import CommandType
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverBasicir(driverNull):
   def __init__(self, server, commandfile):
+    global requests
+    if requests is None:
+      import requests
     driverNull.__init__(self)
 
     self.code_on = "on"
@@ -36,7 +43,7 @@ class driverBasicir(driverNull):
     jdata = open(commandfile)
     self.ircmds = json.load(jdata)
     if not "on" in self.ircmds:
-      logging.debug("Using toggle for %s instead of discreet on/off" % commandfile)
+      logger.debug("Using toggle for %s instead of discreet on/off", commandfile)
       code_on = code_off = "toggle"
 
     """
@@ -55,11 +62,11 @@ class driverBasicir(driverNull):
       }
 
   def eventOn(self):
-    logging.debug("eventOn() for %s" % self.file)
+    logger.debug("eventOn() for %s", self.file)
     self.sendIr(self.code_on)
 
   def eventOff(self):
-    logging.debug("eventOff() for %s" % self.file)
+    logger.debug("eventOff() for %s", self.file)
     self.sendIr(self.code_off)
 
   def sendCommand(self, zone, command):
@@ -67,7 +74,7 @@ class driverBasicir(driverNull):
 
   def sendIr(self, command):
     if not command in self.ircmds:
-      logging.warning("%s is not a defined IR command" % command)
+      logger.warning("%s is not a defined IR command", command)
 
     ir = self.ircmds[command]
 
@@ -75,11 +82,11 @@ class driverBasicir(driverNull):
     try:
       r = requests.post(url, data=json.dumps(ir), timeout=5)
     except:
-      logging.exception("sendIr: " + url)
+      logger.exception("sendIr: %s", url)
       return False
 
     if r.status_code != 200:
-      logging.error("Driver was unable to execute %s" % url)
+      logger.error("Driver was unable to execute %s", url)
       return False
 
     j = r.json()
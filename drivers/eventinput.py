@@ -20,7 +20,6 @@ Wake-On-Lan to wake it from sleep.
 """
 
 from null import driverNull
-import requests
 import base64
 import json
 from modules.commandtype import CommandType
@@ -28,6 +27,8 @@ import subprocess
 import logging
 import socket
 
+logger = logging.getLogger(__name__)
+
 class driverEventinput(driverNull):
   def __init__(self, server, macaddress = None, iface = "eth0"):
     driverNull.__init__(self)
@@ -61,7 +62,7 @@ class driverEventinput(driverNull):
 
   def eventOn(self):
     if self.mac == None:
-      logging.warning("DriverEventService is not configured to support power management")
+      logger.warning("DriverEventService is not configured to support power management")
       return
     subprocess.call(['extras/etherwake', '-i', self.iface, self.mac])
 
@@ -122,5 +123,5 @@ class driverEventinput(driverNull):
         self.socket.sendto(data, (self.server, self.port))
 
     except:
-      logging.exception("execServer: " + url)
+      logger.exception("execServer: %s", url)
       return False
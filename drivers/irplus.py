@@ -65,7 +65,6 @@ sequence. If you miss either or both, the power manegement will not happen.
 
 """
 from null import driverNull
-import requests
 import base64
 import json
 import time
@@ -74,8 +73,16 @@ import logging
 
 from modules.commandtype import CommandType
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverIrplus(driverNull):
   def __init__(self, server, commandfile):
+    global requests
+    if requests is None:
+      import requests
     driverNull.__init__(self)
 
     self.server = server
@@ -135,30 +142,30 @@ class driverIrplus(driverNull):
     return True
 
   def sendCommand(self, zone, command, extras=None):
-    logging.debug("Sending command: " + repr(command))
-    logging.debug("Extras is: " + repr(extras))
+    logger.debug("Sending command: %r", command)
+    logger.debug("Extras is: %r", extras)
 
     cool = self.cooldown - self.getTime()
     if cool > 0:
-      logging.info("Cooldown needed before executing new commands, delaying %d ms", cool)
+      logger.info("Cooldown needed before executing new commands, delaying %d ms", cool)
       time.sleep(cool / 1000.0)
-      logging.info("Cooldown complete, continuing")
+      logger.info("Cooldown complete, continuing")
 
     seq = command.split(",")
     for cmd in seq:
       if cmd.isdigit():
-        logging.debug("Command sequence: Sleep %s ms" % cmd)
+        logger.debug("Command sequence: Sleep %s ms", cmd)
         time.sleep(int(cmd)/1000.0)
       else:
-        logging.debug("Command sequence: Sending %s" % cmd)
+        logger.debug("Command sequence: Sending %s", cmd)
         self.sendIr(cmd)
     if extras is not None and "cooldown" in extras:
-      logging.info("This command requires a cooldown of %d ms", extras["cooldown"])
+      logger.info("This command requires a cooldown of %d ms", extras["cooldown"])
       self.cooldown = self.getTime() + extras["cooldown"]
 
   def sendIr(self, command):
     if not command in self.ircmds:
-      logging.warning("%s is not a defined IR command" % command)
+      logger.warning("%s is not a defined IR command", command)
 
     ir = self.ircmds[command]
 
@@ -166,11 +173,11 @@ class driverIrplus(driverNull):
     try:
       r = requests.post(url, data=json.dumps(ir))
     except:
-      logging.exception("sendIr: " + url)
+      logger.exception("sendIr: %s", url)
       return False
 
     if r.status_code != 200:
-      logging.error("Driver was unable to execute %s" % url)
+      logger.error("Driver was unable to execute %s", url)
       return False
 
     j = r.json()
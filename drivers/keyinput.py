@@ -20,15 +20,22 @@ Wake-On-Lan to wake it from sleep.
 """
 
 from null import driverNull
-import requests
 import base64
 import json
 from modules.commandtype import CommandType
 import subprocess
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverKeyinput(driverNull):
   def __init__(self, server, macaddress = None, iface = "eth0"):
+    global requests
+    if requests is None:
+      import requests
     driverNull.__init__(self)
 
     self.server = "http://" + server + ":5000"
@@ -57,7 +64,7 @@ class driverKeyinput(driverNull):
 
   def eventOn(self):
     if self.mac == None:
-      logging.warning("DriverRestService is not configured to support power management")
+      logger.warning("DriverRestService is not configured to support power management")
       return
     subprocess.call(['extras/etherwake', '-i', self.iface, self.mac])
 
@@ -119,10 +126,10 @@ class driverKeyinput(driverNull):
 
       r = requests.post(self.server + "/interact", data=json.dumps(data), timeout=5)
       if r.status_code != 200:
-        logging.error("Driver was unable to execute %s due to %s" % (repr(data), repr(r)))
+        logger.error("Driver was unable to execute %r due to %r", data, r)
         return False
     except:
-      logging.exception("execServer: " + url)
+      logger.exception("execServer: %s", url)
       return False
 
   def execPower(self, hibernate=False):
@@ -133,8 +140,8 @@ class driverKeyinput(driverNull):
 
       r = requests.post(self.server + "/power", data=json.dumps(data), timeout=5)
       if r.status_code != 200:
-        logging.error("Driver was unable to execute %s due to %s" % (repr(data), repr(r)))
+        logger.error("Driver was unable to execute %r due to %r", data, r)
         return False
     except:
-      logging.exception("execPower: " + url)
+      logger.exception("execPower: %s", url)
       return False
@@ -25,25 +25,33 @@ from modules.commandtype import CommandType
 import traceback
 import logging
 import socket
-import requests
 from xml.etree import ElementTree
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverNull:
   def __init__(self):
+    global requests
+    if requests is None:
+      import requests
     self.power = False
     self.COMMAND_HANDLER = {}
     self.httpTimeout = 250 # 250ms
     self.handlers = []
+    self.eventCallback = None
 
   def eventOn(self):
     """ Override to handle power on event
     """
-    logging.warning("" + repr(self) + " is not implementing power on")
+    logger.warning("%r is not implementing power on", self)
 
   def eventOff(self):
     """ Override to handle power off event
     """
-    logging.warning("" + repr(self) + " is not implementing power off")
+    logger.warning("%r is not implementing power off", self)
 
   def eventExtras(self, keyvalue):
     """ Override this to handle extra data
@@ -73,7 +81,7 @@ class driverNull:
         'content' : content
       }
     except:
-      logging.exception('Failed to parse result')
+      logger.exception('Failed to parse result')
     return result
 
   def httpGet(self, url, contentIsJSON=False, contentIsXML=False):
@@ -86,7 +94,7 @@ class driverNull:
       r = requests.get(url, timeout=self.httpTimeout/1000.0)
       self._handleResponse(r, contentIsXML=contentIsXML, contentIsJSON=contentIsJSON)
     except:
-      logging.exception('HTTP GET failed')
+      logger.exception('HTTP GET failed')
     return result
 
   def httpPost(self, url, data = None, contentIsJSON=False, contentIsXML=False):
@@ -99,7 +107,7 @@ class driverNull:
       r = requests.post(url, data=data, timeout=self.httpTimeout/1000.0)
       self._handleResponse(r, contentIsXML=contentIsXML, contentIsJSON=contentIsJSON)
     except:
-      logging.exception('HTTP POST failed')
+      logger.exception('HTTP POST failed')
     return result
 
   def FQDN2IP(self, fqdn, getIPV6 = False):
@@ -112,14 +120,21 @@ class driverNull:
         family = socket.AF_INET6
       details = socket.getaddrinfo(fqdn, 80, family, socket.SOCK_STREAM)
       if details is None or len(details) < 1:
-        logging.error('Unable to resolve "%s" to a network address', fqdn)
+        logger.error('Unable to resolve "%s" to a network address', fqdn)
       elif len(details) > 1:
-        logging.warning('"%s" returned %d results, only using the first entry', fqdn, len(details))
+        logger.warning('"%s" returned %d results, only using the first entry', fqdn, len(details))
       return details[0][4][0]
     except:
-      logging.exception('Unable to resolve "%s"', fqdn)
+      logger.exception('Unable to resolve "%s"', fqdn)
       return None
 
+  def postEvent(self, zone, namespace, data):
+    """ Reports a change which wasn't caused by a command, such as a new
+        track starting. Safe to call from any thread.
+    """
+    if self.eventCallback is not None:
+      self.eventCallback(zone, namespace, data)
+
   def registerHandler(self, handler, cmds):
     """ API: Registers a handler to be called for cmds defined in list
         Does not have unregister since this should not change during its lifetime
@@ -157,6 +172,12 @@ class driverNull:
   ## housekeeping. It's better to override eventXXX() functions above.
   ############################################################################
 
+  def setEventCallback(self, callback):
+    """ API: Provides the function used by postEvent(), it's called with
+        (zone, namespace, data)
+    """
+    self.eventCallback = callback
+
   def setPower(self, enable):
     """ API: Changes the power state of the device, if the state already
         is at the requested value, then nothing happens.
@@ -171,9 +192,15 @@ class driverNull:
       else:
         self.eventOff()
     except:
-      logging.exception("Exception when calling setPower(%s)" % repr(enable))
+      logger.exception("Exception when calling setPower(%r)", enable)
     return True
 
+  def assumePower(self, enable):
+    """ API: Records the power state without telling the device, used when
+        taking over from a previous process which already powered it.
+    """
+    self.power = enable
+
   def applyExtras(self, keyvaluepairs):
     """ API: Called when this device is selected as a scene, can be called more
         than once during a powered session, since user may switch between
@@ -216,13 +243,13 @@ class driverNull:
         try:
           result = handler['handler'](zone, command, argument)
         except:
-          logging.exception("Exception executing command %s for zone %s" % (repr(command), repr(zone)))
+          logger.exception("Exception executing command %r for zone %r", command, zone)
         break
     return result
     '''
     result = None
     if command not in self.COMMAND_HANDLER:
-      logging.error("%s is not a supported command" % command)
+      logger.error("%s is not a supported command", command)
       return result
 
     try:
@@ -239,7 +266,7 @@ class driverNull:
           result = item["handler"](zone, args[0])
       return result
     except:
-      logging.exception("Exception executing command %s for zone %s" % (repr(command), repr(zone)))
+      logger.exception("Exception executing command %r for zone %r", command, zone)
       return None
 
 
@@ -22,15 +22,22 @@ Note! Currently no way of placing PHT back to sleep after usage.
 """
 
 from null import driverNull
-import requests
 import base64
 import json
 from modules.commandtype import CommandType
 import subprocess
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverPlex(driverNull):
   def __init__(self, server, macaddress = None, iface = "eth0"):
+    global requests
+    if requests is None:
+      import requests
     driverNull.__init__(self)
 
     self.urlPlayback = "/player/playback/"
@@ -60,7 +67,7 @@ class driverPlex(driverNull):
 
   def eventOn(self):
     if self.mac == None:
-      logging.warning("DriverPlex is not configured to support power management")
+      logger.warning("DriverPlex is not configured to support power management")
       return
     subprocess.call(['extras/etherwake', '-i', self.iface, self.mac])
 
@@ -69,13 +76,13 @@ class driverPlex(driverNull):
     self.playbackStop(None)
     self.navHome(None)
     # Sorry, no power control yet
-    logging.debug("Power off isn't implemented yet")
+    logger.debug("Power off isn't implemented yet")
 
   def navUp(self, zone):
     self.execServer(self.urlNavigate + "moveUp")
 
   def navDown(self, zone):
-    logging.info("Hello")
+    logger.info("Hello")
     self.execServer(self.urlNavigate + "moveDown")
 
   def navLeft(self, zone):
@@ -109,10 +116,10 @@ class driverPlex(driverNull):
     try:
       r = requests.get(self.server + url, timeout=5)
       if r.status_code != 200:
-        logging.error("Driver was unable to execute %s due to %s" % (self.server + url, repr(r)))
+        logger.error("Driver was unable to execute %s due to %r", self.server + url, r)
         return False
     except:
-      logging.exception("execServer: " + url)
+      logger.exception("execServer: %s", url)
       return False
 
   def navTextInput(self, zone, txt):
@@ -43,6 +43,8 @@ from null import driverNull
 from modules.commandtype import CommandType
 import logging
 
+logger = logging.getLogger(__name__)
+
 class driverRoku(driverNull):
   def __init__(self, server):
     driverNull.__init__(self)
@@ -67,7 +69,7 @@ class driverRoku(driverNull):
     self.addCommand("text",     CommandType.NAVIGATE_TEXTINPUT,     self.navTextInput, None, None, None, 1)
 
   def eventOff(self):
-    requests.post(self.server + "keypress/Home")    
+    self.httpPost(self.server + "keypress/Home")
 
   def eventExtras(self, extras):
     """
@@ -82,7 +84,7 @@ class driverRoku(driverNull):
     if "app" in extras:
       k = extras["app"].lower()
       for key in self.apps:
-        logging.debug("Testing \"%s\" for \"%s\", returning %d" % (key.lower(), k.lower(), key.lower().find(k)))
+        logger.debug("Testing \"%s\" for \"%s\", returning %d", key.lower(), k.lower(), key.lower().find(k))
         if key.lower().find(k) > -1:
           self.startApp(self.apps[key])
           break
@@ -94,7 +96,7 @@ class driverRoku(driverNull):
           break
 
   def getApps(self):
-    logging.debug("getApps() called")
+    logger.debug("getApps() called")
     result = {}
     tree = self.httpGet(self.server + "query/apps", contentIsXML=True)
     if tree['content'] is None:
@@ -102,7 +104,7 @@ class driverRoku(driverNull):
     tree = tree['content']
 
     if tree.tag != "apps":
-      logging.error("Roku didn't respond with apps list")
+      logger.error("Roku didn't respond with apps list")
       return {}
     for branch in tree:
       if branch.tag == "app" and branch.attrib["type"] == "menu":
@@ -112,7 +114,7 @@ class driverRoku(driverNull):
       if branch.tag != "app" or branch.attrib["type"] != "appl":
         continue
       result[branch.text] = int(branch.attrib["id"])
-    logging.debug("getApps() = " + repr(result))
+    logger.debug("getApps() = %r", result)
     return result
 
   def startApp(self, appid):
@@ -16,10 +16,14 @@
 """
 Implementation of RX-V1900 commands
 """
-import requests
 from modules.commandtype import CommandType
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Imported when the first instance is created
+requests = None
+
 class driverRxv1900:
   cfg_YamahaController = None
 
@@ -202,7 +206,7 @@ class driverRxv1900:
     elif i == 7:
       self.power = [False, False, True]
 
-    logging.info("Powerstate has changed to " + str(self.power))
+    logger.info("Powerstate has changed to %s", self.power)
     return
 
   def handleVolume(self, cmd, data):
@@ -213,13 +217,26 @@ class driverRxv1900:
     elif cmd == "A2": # Zone 3
       z = 2
     else:
-      logging.warning("Unknown command " + cmd)
+      logger.warning("Unknown command %s", cmd)
       return
 
     self.volume[z] = int(data, 16)
-    logging.info("Volume has changed for Zone " + str(z+1) + " to " + data)
+    logger.info("Volume has changed for Zone %d to %s", z+1, data)
+    self.postVolume(z+1)
     return
 
+  def setEventCallback(self, callback):
+    self.eventCallback = callback
+
+  def postVolume(self, zone):
+    """Lets the system know about the volume state for a zone"""
+    if self.eventCallback is None:
+      return
+    self.eventCallback(str(zone), "zone.volume.state", {
+      "level" : self.translateVolumeFrom(self.volume[zone-1]),
+      "muted" : self.mute[zone-1],
+    })
+
   def handleInput(self, cmd, data):
     # Translate zone info
     if cmd == "21":
@@ -229,16 +246,16 @@ class driverRxv1900:
     elif cmd == "A0":
       z = 2
     else:
-      logging.warning("Unknown command " + cmd)
+      logger.warning("Unknown command %s", cmd)
       return
     # now, lets translate the actual input that happened
     self.input[z] = self.MAP_INPUT[z][int(data, 16)]
-    logging.info("Input for zone " + str(z+1) + " is " + str(self.input[z]))
+    logger.info("Input for zone %d is %s", z+1, self.input[z])
 
 
   def issueOperation(self, zone, cmd):
     function = self.OPERATION_TABLE["zone" + str(zone)][cmd]
-    logging.debug("zone" + str(zone) + ": " + cmd + " = " + repr(function))
+    logger.debug("zone%s: %s = %r", zone, cmd, function)
 
     url = self.cfg_YamahaController + "/operation/" + function[0]
     if function[1] != None:
@@ -247,16 +264,16 @@ class driverRxv1900:
     try:
       r = requests.get(url, timeout=5)
       if r.status_code != 200:
-        logging.error("Remote was unable to execute command %s" % cmd)
+        logger.error("Remote was unable to execute command %s", cmd)
         return False
     except:
-      logging.exception("issueOperation: " + url)
+      logger.exception("issueOperation: %s", url)
       return False
 
     j = r.json()
 
     if j["status"] != 200:
-      logging.error("Remote received command but failed to execute")
+      logger.error("Remote received command but failed to execute")
       return False
 
     if function[1] != None:
@@ -272,14 +289,14 @@ class driverRxv1900:
     try:
       r = requests.get(url, timeout=5)
       if r.status_code != 200:
-        logging.error("Remote was unable to execute command")
+        logger.error("Remote was unable to execute command")
         return None
     except:
-      logging.exception("getStatus: " + url)
+      logger.exception("getStatus: %s", url)
       return None
 
     j = r.json()
-    logging.info("Report said:" + repr(j))
+    logger.info("Report said: %r", j)
     return j
 
   def issueSystem(self, zone, command, data):
@@ -290,7 +307,7 @@ class driverRxv1900:
     if len(param) < 2:
       param = "0" + param
 
-    logging.debug("Zone " + str(zone) + ": " + repr(command) + " = " + repr(function) + " (param: '" + repr(param) + "')")
+    logger.debug("Zone %s: %r = %r (param: '%r')", zone, command, function, param)
     url = self.cfg_YamahaController + "/system/" + function[0] + param
     if function[1] != None:
       url += "/" + function[1]
@@ -298,16 +315,16 @@ class driverRxv1900:
     try:
       r = requests.get(url, timeout=5)
       if r.status_code != 200:
-        logging.error("Remote was unable to execute command")
+        logger.error("Remote was unable to execute command")
         return False
     except:
-      logging.exception("issueSystem: " + url)
+      logger.exception("issueSystem: %s", url)
       return False
 
     j = r.json()
 
     if j["status"] != 200:
-      logging.error("Remote received command but failed to execute")
+      logger.error("Remote received command but failed to execute")
       return False
 
     if function[1] != None:
@@ -318,14 +335,17 @@ class driverRxv1900:
   def interpretResult(self, result):
     # Dig deeper in the result
     if not result["valid"]:
-      logging.warning("Result isn't valid: " + result)
+      logger.warning("Result isn't valid: %s", result)
     elif not result["command"] in self.RESPONSE_HANDLER:
-      logging.warning("No handler defined for " + str(result))
+      logger.warning("No handler defined for %s", result)
     else:
       self.RESPONSE_HANDLER[result["command"]](result["command"], result["data"])
     return
 
   def __init__(self, server, eventCallback=None):
+    global requests
+    if requests is None:
+      import requests
     self.cfg_YamahaController = server
     self.eventCallback = eventCallback
 
@@ -444,7 +464,7 @@ class driverRxv1900:
   def handleCommand(self, zone, command, *args):
     result = None
     if not command in self.COMMAND_HANDLER:
-      logging.error("%s is not a command" % command)
+      logger.error("%s is not a command", command)
       return result
     zone = int(zone)
     item = self.COMMAND_HANDLER[command]
@@ -462,16 +482,20 @@ class driverRxv1900:
 
   # Controls the power of the various zones
   #
+  def assumePower(self, zone, power):
+    """Records the power state without telling the receiver"""
+    self.power[int(zone)-1] = power
+
   def setPower(self, zone, power):
     # Make sure we don't do silly things
     ret = False
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     if self.power[zone-1] == power:
-      logging.warn("Zone " + str(zone) + " already set to desired power state (" + str(power) + ")")
+      logger.warn("Zone %s already set to desired power state (%s)", zone, power)
       return True
 
     if power:
@@ -491,7 +515,7 @@ class driverRxv1900:
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     return self.power[zone-1]
@@ -499,7 +523,7 @@ class driverRxv1900:
   def setMute(self, zone, mute):
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     if mute:
@@ -507,13 +531,16 @@ class driverRxv1900:
     else:
       ret = self.issueOperation(zone, "unmute")
 
+    if ret:
+      self.mute[zone-1] = mute
+      self.postVolume(zone)
     return ret
 
   def getMute(self, zone):
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     return self.mute[zone-1]
@@ -531,7 +558,7 @@ class driverRxv1900:
     """
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     volume = int(volume)
@@ -541,7 +568,7 @@ class driverRxv1900:
     #else:
     volume = self.translateVolumeTo(volume)
 
-    logging.debug("setVoume(%s) = 0x%02x", volume, volume)
+    logger.debug("setVoume(%s) = 0x%02x", volume, volume)
 
     if self.issueSystem(zone, "vol-set", "%02x" % volume):
       return {'volume' : self.translateVolumeFrom(self.volume[zone-1])}
@@ -552,7 +579,7 @@ class driverRxv1900:
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
     if self.volume[zone-1] < 199:
       self.volume[zone-1] += 1
@@ -564,7 +591,7 @@ class driverRxv1900:
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
     if self.volume[zone-1] > 39:
       self.volume[zone-1] -= 1
@@ -576,7 +603,7 @@ class driverRxv1900:
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     return {'volume' : self.translateVolumeFrom(self.volume[zone-1])}
@@ -585,12 +612,12 @@ class driverRxv1900:
     # Make sure we don't do silly things
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     # Figure out if this is a valid input for the zone
     if not input in self.OPERATION_TABLE["zone" + str(zone)]:
-      logging.error("" + input + " not supported by zone " + str(zone))
+      logger.error("%s not supported by zone %s", input, zone)
       return False
 
     # Alright, let's do it!
@@ -599,7 +626,7 @@ class driverRxv1900:
   def getInput(self, zone):
     zone = int(zone)
     if zone < 1 or zone > 3:
-      logging.error("Zone " + str(zone) + " not supported by driver")
+      logger.error("Zone %s not supported by driver", zone)
       return False
 
     return self.input[zone-1]
@@ -0,0 +1,126 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Tracks the version of the system state.
+
+Every time something changes (scene assignment, subzone, remote attachment,
+registration, etc) the version is increased. This allows the REST layer to
+tell if a client already has the latest state without recomputing it.
+
+The most recent changes are also kept in a journal so a client can ask what
+changed since a specific version, and listeners can be registered to find
+out as soon as something changes.
+"""
+import uuid
+import threading
+import collections
+
+class ChangeLog:
+  JOURNAL_SIZE = 1000
+
+  def __init__(self):
+    # Versions restart at 0 with every process, the epoch tells them apart
+    self.epoch = uuid.uuid4().hex[:8]
+    self.version = 0
+    self.lock = threading.Lock()
+    self.journal = collections.deque(maxlen=self.JOURNAL_SIZE)
+    self.listeners = []
+
+  def changed(self, kind, key):
+    """
+    Records that something of a kind (zone, scene, subzone, remote, ...)
+    identified by key has changed. Returns the new version.
+    """
+    with self.lock:
+      self.version += 1
+      version = self.version
+      self.journal.append((version, kind, key))
+      listeners = list(self.listeners)
+
+    for listener in listeners:
+      listener(version)
+    return version
+
+  def getVersion(self):
+    """Returns the current state version"""
+    return self.version
+
+  def getEpoch(self):
+    """Returns an id which is unique to this process"""
+    return self.epoch
+
+  def getToken(self, version=None):
+    """
+    Returns the version as a token for clients, "<epoch>.<version>", so a
+    version handed out by an earlier process is never mistaken for a
+    current one.
+    """
+    if version is None:
+      version = self.version
+    return "%s.%d" % (self.epoch, version)
+
+  def parseToken(self, token):
+    """
+    Returns the version held by a token from getToken(), or None if it was
+    issued by another process or can't be parsed.
+    """
+    try:
+      epoch, version = token.split(".")
+      version = int(version)
+    except (AttributeError, ValueError):
+      return None
+    if epoch != self.epoch or version < 0:
+      return None
+    return version
+
+  def getChanges(self, since):
+    """
+    Returns what has changed since the provided version as a dict of
+    kind -> list of keys. If the version is unknown (None, or newer than
+    the current one) or the journal no longer covers it, None is returned
+    and the client needs to start from scratch.
+    """
+    with self.lock:
+      if since is None or since < 0 or since > self.version:
+        return None
+      if since == self.version:
+        return {}
+      if len(self.journal) == 0 or self.journal[0][0] > since + 1:
+        return None
+
+      result = {}
+      for (version, kind, key) in self.journal:
+        if version <= since:
+          continue
+        if kind not in result:
+          result[kind] = []
+        if key not in result[kind]:
+          result[kind].append(key)
+      return result
+
+  def addListener(self, listener):
+    """
+    Registers a function which is called with the new version whenever
+    something changes. NOTE! It's called from whatever thread caused
+    the change.
+    """
+    with self.lock:
+      self.listeners.append(listener)
+
+  def removeListener(self, listener):
+    with self.lock:
+      if listener in self.listeners:
+        self.listeners.remove(listener)
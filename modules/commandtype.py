@@ -110,6 +110,15 @@ class CommandType:
   # Undefined should NEVER be used, but are handy for automatic prefill
   PRIVATE_UNDEFINED     = 10000
 
+  """ Commands which set an absolute value, only the latest one matters
+      when several are issued in a row.
+  """
+  ABSOLUTE = [VOLUME_SET]
+
+  @staticmethod
+  def isAbsolute(cmd):
+    return cmd in CommandType.ABSOLUTE
+
   @staticmethod
   def isCommand(cmd):
     return cmd < CommandType.LIMIT_GETCOMMANDS
\ No newline at end of file
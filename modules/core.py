@@ -22,8 +22,17 @@ should it be possible.
 Also able to reply back regarding state of various parts of the system
 """
 from commandtype import CommandType
+from metrics import REGISTRY
+from timing import DRIVER_TIMING
+from tracing import traced
+from latestwins import LatestWins
 import logging
 
+logger = logging.getLogger(__name__)
+
+COMMANDS = REGISTRY.counter("multiremote_commands_total", "Commands executed on behalf of remotes", ["category", "result"])
+COALESCED = REGISTRY.counter("multiremote_commands_coalesced_total", "Absolute value commands replaced by a newer one before being executed")
+
 class Core:
   """
   DRIVER_TABLE = None
@@ -32,10 +41,12 @@ class Core:
   ZONE_TABLE = None
   """
 
-  def __init__(self, setup, remotemgr):
+  def __init__(self, setup, remotemgr, changes):
     """
     At this point, initialize some extra parameters, such as the combined
     capabilties of zones which have sub-zones.
+
+    changes is the ChangeLog which gets told about any state changes
     """
     # Load data
     self.DRIVER_TABLE   = setup['DRIVER_TABLE']
@@ -44,6 +55,10 @@ class Core:
     self.ZONE_TABLE     = setup['ZONE_TABLE']
     self.OPTIONS        = setup['OPTIONS']
     self.REMOTEMGR      = remotemgr
+    self.CHANGES        = changes
+    self.EVENTS         = None
+    self.LATEST         = LatestWins()
+    REGISTRY.gauge("multiremote_state_version", "Current state version", function=changes.getVersion)
 
     # Validate zone structure and provide good defaults
     for z in self.ZONE_TABLE:
@@ -54,7 +69,7 @@ class Core:
         self.ZONE_TABLE[z]["video"] = None
         for s in self.ZONE_TABLE[z]["subzones"]:
           if not "subzone-default" in self.ZONE_TABLE[z]: # Set a default
-            logging.warn("No default subzone defined for %s, setting it to %s" % (z, s))
+            logger.warn("No default subzone defined for %s, setting it to %s", z, s)
             self.ZONE_TABLE[z]["subzone-default"] = s
 
           if not self.ZONE_TABLE[z]["subzones"][s]["audio"] is None and self.ZONE_TABLE[z]["audio"] is None:
@@ -70,7 +85,7 @@ class Core:
 
   def getSceneListForZone(self, zone):
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return []
     return self.getSceneList(self.hasZoneAudio(zone), self.hasZoneVideo(zone))
 
@@ -93,7 +108,7 @@ class Core:
   def getScene(self, name):
     """Obtains the details of a specific scene"""
     if not self.hasScene(name):
-      logging.error("%s is not a scene" % name)
+      logger.error("%s is not a scene", name)
       return None
     return self.SCENE_TABLE[name]
 
@@ -103,7 +118,7 @@ class Core:
 
   def getSceneZoneUsage(self, name):
     if not self.hasScene(name):
-      logging.error("%s is not a scene")
+      logger.error("%s is not a scene", name)
       return []
 
     result = []
@@ -114,15 +129,13 @@ class Core:
 
   def getSceneRemoteUsage(self, name):
     if not self.hasScene(name):
-      logging.error("%s is not a scene")
+      logger.error("%s is not a scene", name)
       return []
 
     result = []
     for z in self.ZONE_TABLE:
       if self.ZONE_TABLE[z]["active-scene"] == name:
-        for r in self.REMOTEMGR.list():
-          if self.REMOTEMGR.get(r, "active-zone") == z:
-            result.append(r)
+        result += self.REMOTEMGR.listByZone(z)
     return result
 
   def getZoneList(self):
@@ -135,98 +148,108 @@ class Core:
   def getZone(self, name):
     """Return the settings for a zone"""
     if not self.hasZone(name):
-      logging.error("%s is not a zone" % name)
+      logger.error("%s is not a zone", name)
       return None
     return self.ZONE_TABLE[name]
 
   def hasSubZones(self, zone):
     """Tests if the zone has subzones"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
     return "subzones" in self.ZONE_TABLE[zone]
 
   def hasSubZone(self, zone, sub):
     """Tests if a zone has a specific subzone"""
     if not self.hasSubZones(zone):
-      logging.error("%s does not have subzones" % zone)
+      logger.error("%s does not have subzones", zone)
       return False
     return sub in self.ZONE_TABLE[zone]["subzones"]
 
+  @traced("Core.setZoneScene")
   def setZoneScene(self, zone, scene):
     """Set the scene for a zone"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
     elif not self.hasScene(scene):
-      logging.error("%s is not a scene" % scene)
+      logger.error("%s is not a scene", scene)
       return False
 
     if self.SCENE_TABLE[scene]["audio"] and self.ZONE_TABLE[zone]["audio"] == None:
-      logging.warning("Zone %s does not support audio which is provided by the scene %s" % (zone, scene))
+      logger.warning("Zone %s does not support audio which is provided by the scene %s", zone, scene)
     if self.SCENE_TABLE[scene]["video"] and self.ZONE_TABLE[zone]["video"] == None:
-      logging.warning("Zone %s does not support video which is provided by the scene %s" % (zone, scene))
+      logger.warning("Zone %s does not support video which is provided by the scene %s", zone, scene)
+    if self.ZONE_TABLE[zone]["active-scene"] is not None:
+      self.CHANGES.changed("scene", self.ZONE_TABLE[zone]["active-scene"])
     self.ZONE_TABLE[zone]["active-scene"] = scene
+    self.CHANGES.changed("scene", scene)
 
     # Handle subzones...
     if self.hasSubZones(zone):
       if self.ZONE_TABLE[zone]["active-subzone"] is None:
         self.ZONE_TABLE[zone]["active-subzone"] = self.ZONE_TABLE[zone]["subzone-default"]
 
+    self.CHANGES.changed("zone", zone)
     return True
 
   def getZoneScene(self, zone):
     """Get the current scene for a zone"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return None
     return self.ZONE_TABLE[zone]["active-scene"]
 
   def clearZoneScene(self, zone):
     """Removes the scene for a zone"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
+    if self.ZONE_TABLE[zone]["active-scene"] is not None:
+      self.CHANGES.changed("scene", self.ZONE_TABLE[zone]["active-scene"])
     self.ZONE_TABLE[zone]["active-scene"] = None
+    self.CHANGES.changed("zone", zone)
     return True
 
   def getSubZone(self, zone):
     """Get active subzone for a zone"""
     if not self.hasSubZones(zone):
-      logging.error("%s does not have subzones" % zone)
+      logger.error("%s does not have subzones", zone)
       return None
     return self.ZONE_TABLE[zone]["active-subzone"]
 
   def getSubZoneDefault(self, zone):
     """Get active subzone for a zone"""
     if not self.hasSubZones(zone):
-      logging.error("%s does not have subzones" % zone)
+      logger.error("%s does not have subzones", zone)
       return None
     return self.ZONE_TABLE[zone]["subzone-default"]
 
   def setSubZone(self, zone, sub):
     """Set the subzone for a zone"""
     if not self.hasSubZone(zone, sub):
-      logging.error("%s does not have sub zone %s" % (zone, sub))
+      logger.error("%s does not have sub zone %s", zone, sub)
       return False
     self.ZONE_TABLE[zone]["active-subzone"] = sub
+    self.CHANGES.changed("subzone", zone)
     return True
 
   def clearSubZone(self, zone):
     """This one is special, it will switch to default subzone"""
     if not self.hasSubZones(zone):
-      logging.error("%s does not have subzones" % zone)
+      logger.error("%s does not have subzones", zone)
       return False
     self.ZONE_TABLE[zone]["active-subzone"] = self.getSubZoneDefault(zone)
+    self.CHANGES.changed("subzone", zone)
     return True
 
   def getSubZoneList(self, zone):
     """Get all subzones"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return {}
     if not self.hasSubZones(zone):
-      logging.error("%s does not have subzones" % zone)
+      logger.error("%s does not have subzones", zone)
       return {}
 
     result = {}
@@ -237,54 +260,64 @@ class Core:
   def hasZoneAudio(self, zone):
     """Tests if a zone has audio capabilities"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
     return self.ZONE_TABLE[zone]["audio"] != None
 
   def hasZoneVideo(self, zone):
     """Tests if a zone has video capabilities"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
     return self.ZONE_TABLE[zone]["video"] != None
 
   def setRemoteZone(self, remote, zone):
     """Set the zone which should be controlled by the remote"""
     if not self.REMOTEMGR.has(remote):
-      logging.error("%s is not a remote" % remote)
+      logger.error("%s is not a remote", remote)
       return False
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return False
+    self.markZoneChanged(self.getRemoteZone(remote))
     self.REMOTEMGR.set(remote, "active-zone", zone)
+    self.markZoneChanged(zone)
     return True
 
   def getRemoteZone(self, name):
     """Get the zone which the remote is controlling"""
     if not self.REMOTEMGR.has(name):
-      logging.error("%s is not a remote" % name)
+      logger.error("%s is not a remote", name)
       return None
     return self.REMOTEMGR.get(name, "active-zone")
 
   def getZoneRemoteList(self, zone):
     """Gets a list of remotes currently controlling the zone"""
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return []
 
-    result = []
-    for r in self.REMOTEMGR.list():
-      if self.REMOTEMGR.get(r, "active-zone") == zone:
-        result.append(r)
-    return result
+    return self.REMOTEMGR.listByZone(zone)
 
   def clearRemoteZone(self, remote):
     if not self.REMOTEMGR.has(remote):
-      logging.error("%s is not a remote" % remote)
+      logger.error("%s is not a remote", remote)
       return False
+    self.markZoneChanged(self.getRemoteZone(remote))
     self.REMOTEMGR.set(remote, "active-zone", None)
     return True
 
+  def markZoneChanged(self, zone):
+    """
+    Lets the ChangeLog know that the remotes using a zone (and by extension
+    its scene) has changed
+    """
+    if zone is None or not self.hasZone(zone):
+      return
+    self.CHANGES.changed("zone", zone)
+    if self.ZONE_TABLE[zone]["active-scene"] is not None:
+      self.CHANGES.changed("scene", self.ZONE_TABLE[zone]["active-scene"])
+
   def getZoneCommands(self, zone):
     result = {}
     s = self.getZoneScene(zone)
@@ -306,11 +339,11 @@ class Core:
 
   def getSceneCommands(self, scene):
     if not self.hasScene(scene):
-      logging.error("%s is not a scene" % scene)
+      logger.error("%s is not a scene", scene)
       return {}
     drv = self.getDriver(self.SCENE_TABLE[scene]["driver"])
     if drv is None:
-      logging.error("Cannot find driver for scene %s" % scene)
+      logger.error("Cannot find driver for scene %s", scene)
       return {}
     result = drv.getCommands()
 
@@ -342,17 +375,17 @@ class Core:
     """
     result = {"zone" : {}, "scene" : {}}
     if not self.REMOTEMGR.has(remote):
-      logging.error("%s is not a remote" % remote)
+      logger.error("%s is not a remote", remote)
       return result
 
     if self.getRemoteZone(remote) == None:
-      logging.warning("Remote %s isn't attached to a zone" % remote)
+      logger.warning("Remote %s isn't attached to a zone", remote)
       return result
 
     zname = self.getRemoteZone(remote)
     sname = self.getZoneScene(zname)
     if sname is None:
-      logging.warn("Zone %s is not assigned a scene" % zname)
+      logger.warn("Zone %s is not assigned a scene", zname)
       #return []
 
     result["zone"] = self.getZoneCommands(zname)
@@ -361,51 +394,128 @@ class Core:
     return result
 
   def execZoneCommand(self, remote, command, extras):
+    return self.execResolved("zone", self.resolveCommand(remote, "zone", command), command, extras)
+
+  def execSceneCommand(self, remote, command, extras):
+    logger.debug("execSceneCommand called")
+    return self.execResolved("scene", self.resolveCommand(remote, "scene", command), command, extras)
+
+  def resolveCommand(self, remote, category, command):
+    """
+    Finds what would handle command (zone or scene category) for remote.
+    Returns (driver name, driver, zone, command type) which can be handed to
+    execResolved() for as long as the state version hasn't changed, None if
+    nothing does.
+    """
     if not self.REMOTEMGR.has(remote):
-      logging.error("%s is not a remote" % remote)
-      return False
+      logger.error("%s is not a remote", remote)
+      return None
     zone = self.getRemoteZone(remote)
     scene = self.getZoneScene(zone)
     if scene is None:
-      return False
+      return None
     scene = self.getScene(scene)
 
-    (adrv, vdrv) = self.getZoneDrivers(zone)
-    if adrv is not None:
-      (adrv, az) = self.splitDriver(adrv)
-    if vdrv is not None:
-      (vdrv, vz) = self.splitDriver(vdrv)
-    adrv = self.getDriver(adrv)
-    vdrv = self.getDriver(vdrv)
+    if category == "scene":
+      drv = self.getDriver(scene["driver"])
+      commands = drv.getCommands()
+      if command in commands:
+        return (scene["driver"], drv, None, commands[command]["type"])
+      logger.warning("%s is not a command", command)
+      return None
+
+    (aname, vname) = self.getZoneDrivers(zone)
+    if aname is not None:
+      (aname, az) = self.splitDriver(aname)
+    if vname is not None:
+      (vname, vz) = self.splitDriver(vname)
+    adrv = self.getDriver(aname)
+    vdrv = self.getDriver(vname)
 
     if adrv is not None and scene["audio"]:
-      if command in adrv.getCommands():
-        return adrv.handleCommand(az, command, extras)
+      commands = adrv.getCommands()
+      if command in commands:
+        return (aname, adrv, az, commands[command]["type"])
     if vdrv is not None and scene["video"]:
-      if command in vdrv.getCommands():
-        return vdrv.handleCommand(vz, command, extras)
-
-    return False
-
-  def execSceneCommand(self, remote, command, extras):
-    logging.debug("execSceneCommand called")
-    if not self.REMOTEMGR.has(remote):
-      logging.error("%s is not a remote" % remote)
-      return False
-    zone = self.getRemoteZone(remote)
-    scene = self.getZoneScene(zone)
-    if scene is None:
-      return False
-    scene = self.getScene(scene)
+      commands = vdrv.getCommands()
+      if command in commands:
+        return (vname, vdrv, vz, commands[command]["type"])
+    return None
 
-    drv = self.getDriver(scene["driver"])
-    if command in drv.getCommands():
-      return drv.handleCommand(None, command, extras)
-    else:
-      logging.warning("%s is not a command" % command)
+  def execResolved(self, category, target, command, extras):
+    """
+    Executes command using the result of resolveCommand(). Absolute value
+    commands (such as volume-set) are queued per driver and zone, replacing
+    any older value not yet sent, and {"queued" : True, "result" : "queued"}
+    is returned right away, with "last-result" holding the outcome of the
+    previous one (if any). Their outcome is posted as a zone.command.result
+    event.
+    """
+    result = False
+    if target is not None:
+      (name, drv, zone, cmdtype) = target
+      if CommandType.isAbsolute(cmdtype):
+        ret = {"queued" : True, "result" : "queued"}
+        last = self.LATEST.getLast((name, zone))
+        if last is not None:
+          ret["last-result"] = last
+        if self.LATEST.submit((name, zone), self._execLatest, category, target, command, extras):
+          COALESCED.inc()
+        return ret
+      result = DRIVER_TIMING.call(name, command, drv.handleCommand, zone, command, extras)
+
+    COMMANDS.labels(category, "failed" if result is None or result is False else "ok").inc()
+    return result
 
-    return False
+  def _execLatest(self, category, target, command, extras):
+    (name, drv, zone, cmdtype) = target
+    result = DRIVER_TIMING.call(name, command, drv.handleCommand, zone, command, extras)
+    outcome = "failed" if result is None or result is False else "ok"
+    COMMANDS.labels(category, outcome).inc()
+
+    if self.EVENTS is not None:
+      if zone is not None:
+        name = "%s:%s" % (name, zone)
+      data = {"command" : command, "arguments" : extras, "result" : outcome}
+      for z in self.getZonesUsingDriver(name):
+        self.EVENTS.post("zone.command.result", z, data)
+    return outcome
+
+  def setEventBus(self, bus):
+    """
+    Lets drivers which can report changes on their own (such as volume
+    changes) post events. These are delivered to the zones currently
+    using the driver.
+    """
+    self.EVENTS = bus
+    for name in self.DRIVER_TABLE:
+      driver = self.DRIVER_TABLE[name]
+      if hasattr(driver, "setEventCallback"):
+        driver.setEventCallback(self._driverEventHandler(bus, name))
+
+  def _driverEventHandler(self, bus, name):
+    def handler(zone, namespace, data):
+      if zone is None:
+        driver = name
+      else:
+        driver = "%s:%s" % (name, zone)
+      for z in self.getZonesUsingDriver(driver):
+        bus.post(namespace, z, data)
+    return handler
 
+  def getZonesUsingDriver(self, driver):
+    """
+    Returns the zones which currently use a driver, either as its
+    audio/video driver or as the driver of the active scene.
+    """
+    result = []
+    for z in self.ZONE_TABLE:
+      scene = self.ZONE_TABLE[z]["active-scene"]
+      if scene is None:
+        continue
+      if driver in self.getZoneDrivers(z) or self.SCENE_TABLE[scene]["driver"] == driver:
+        result.append(z)
+    return result
 
   def getZoneDrivers(self, zone):
     """
@@ -413,10 +523,10 @@ class Core:
     then this function replaces that with None
     """
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return (None, None)
     if self.ZONE_TABLE[zone]["active-scene"] is None:
-      logging.error("No scene for zone %s" % zone)
+      logger.error("No scene for zone %s", zone)
       return (None, None)
     if self.hasSubZones(zone):
       sz = self.ZONE_TABLE[zone]["active-subzone"]
@@ -424,6 +534,7 @@ class Core:
     else:
       return (self.ZONE_TABLE[zone]["audio"], self.ZONE_TABLE[zone]["video"])
 
+  @traced("Core.getCurrentState")
   def getCurrentState(self):
     """
     Shows the current state which indicates what's going on.
@@ -470,10 +581,10 @@ class Core:
     provided scene will be used instead.
     """
     if not self.hasZone(zone):
-      logging.error("%s is not a zone" % zone)
+      logger.error("%s is not a zone", zone)
       return None
     if not sceneOverride is None and not self.hasScene(sceneOverride):
-      logging.error("%s is not a scene" % sceneOverride)
+      logger.error("%s is not a scene", sceneOverride)
       return None
     if self.ZONE_TABLE[zone]["active-scene"] is None and sceneOverride is None:
       return None
@@ -514,9 +625,9 @@ class Core:
     elif self.SCENE_TABLE[s]["audio"] and self.SCENE_TABLE[s]["video"]:
       route = self.resolveRoute(sdrv, adrv, vdrv)
     elif not self.SCENE_TABLE[s]["audio"] and self.SCENE_TABLE[s]["video"]:
-      logging.error("Video only zones are not supported")
+      logger.error("Video only zones are not supported")
     else:
-      logging.error("Scene has neither audio nor video!")
+      logger.error("Scene has neither audio nor video!")
 
     return self.translateRoute(zone, route)
 
@@ -526,7 +637,7 @@ class Core:
     optionally video driver.
     """
     if sdrv not in self.ROUTING_TABLE:
-      logging.error("%s does not have any routing information" % sdrv)
+      logger.error("%s does not have any routing information", sdrv)
       return []
 
     if vdrv == None or not "audio+video" in self.ROUTING_TABLE[sdrv]:
@@ -539,7 +650,7 @@ class Core:
       routes = self.filterRoutes(routes, vdrv)
 
     if len(routes) != 1:
-      logging.warning("Routing was inconclusive, got %d routes" % len(routes))
+      logger.warning("Routing was inconclusive, got %d routes", len(routes))
 
     route = routes[0]
     if not sdrv in route:
@@ -607,6 +718,7 @@ class Core:
 
     return result
 
+  @traced("Core.checkConflict")
   def checkConflict(self, zone, scene):
     """
     Checks if there is a conflict assigning a scene to a zone.
@@ -643,10 +755,10 @@ class Core:
     # Find any overlap of drivers
     result = []
     for z in active:
-      logging.debug("Checking zone " + z)
+      logger.debug("Checking zone %s", z)
       for d in active[z]["route"]:
         if d in route:
-          logging.warning("Overlap detected, %s is already in use")
+          logger.warning("Overlap detected, %s is already in use")
           result.append(z)
           break
 
@@ -660,7 +772,7 @@ class Core:
 
     (driver, ignore) = self.translateDriver(driver)
     if not driver in self.DRIVER_TABLE:
-      logging.error("%s is not a driver" % driver)
+      logger.error("%s is not a driver", driver)
       return None
     return self.DRIVER_TABLE[driver]
 
@@ -670,7 +782,7 @@ class Core:
     UUID matching can be disabled.
     """
     if allowUUID and len(pin) == 32:
-      logging.debug("PIN is a UUID, look up the remote instead")
+      logger.debug("PIN is a UUID, look up the remote instead")
       return self.REMOTEMGR.has(pin)
     else:
       return pin == self.OPTIONS["pin-remote"]
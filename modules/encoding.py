@@ -0,0 +1,106 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Per-connection encoding of event messages.
+
+Remotes can ask for MessagePack instead of JSON (requires the msgpack
+module, otherwise JSON is used) and for delta encoding of state messages,
+where only the fields which changed since the last message of the same kind
+are sent:
+
+  {
+    "namespace" : ...,
+    "destination" : ...,
+    "source" : ...,
+    "delta" : {<changed fields>},
+    "removed" : [<fields no longer present>]
+  }
+
+The first message of each kind is always sent in full.
+"""
+import json
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+class EventEncoder:
+  def __init__(self, compact=False, delta=False):
+    """
+    compact = Use MessagePack (binary frames) if available
+    delta   = Only send changed fields for state messages
+    """
+    self.compact = compact and msgpack is not None
+    self.delta = delta
+    self.previous = {}
+
+  def isDefault(self):
+    """True if the plain JSON encoding (shared by all remotes) can be used"""
+    return not self.compact and not self.delta
+
+  def encode(self, data, message):
+    """
+    Returns (payload, binary) for a message, data is the message already
+    encoded as plain JSON.
+    """
+    if self.isDefault():
+      return (data, False)
+
+    if self.delta:
+      if message.get("namespace", None) == "replay":
+        # Replays are always complete, but update what the remote knows
+        for m in message["data"]:
+          self._remember(m)
+      else:
+        message = self._delta(message)
+
+    if self.compact:
+      return (msgpack.packb(message), True)
+    return (json.dumps(message, separators=(',', ':')), False)
+
+  def _key(self, message):
+    namespace = message.get("namespace", None)
+    if namespace is None or not namespace.endswith(".state") or not isinstance(message["data"], dict):
+      return None
+    return (namespace, message["destination"], message["data"].get("zone", None))
+
+  def _remember(self, message):
+    key = self._key(message)
+    if key is not None:
+      self.previous[key] = message["data"]
+    return key
+
+  def _delta(self, message):
+    key = self._key(message)
+    if key is None:
+      return message
+    previous = self.previous.get(key, None)
+    self.previous[key] = message["data"]
+    if previous is None:
+      return message
+
+    changed = {}
+    for k in message["data"]:
+      if k not in previous or previous[k] != message["data"][k]:
+        changed[k] = message["data"][k]
+    removed = [k for k in previous if k not in message["data"]]
+
+    result = dict((k, v) for k, v in message.items() if k != "data")
+    result["delta"] = changed
+    if len(removed) > 0:
+      result["removed"] = removed
+    return result
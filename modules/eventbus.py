@@ -0,0 +1,69 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Simple publish/subscribe event bus.
+
+Events can be posted from any thread (REST handlers, router, drivers, etc)
+and are delivered in batches to the listeners using the scheduler, which
+for multiRemote is the IOLoop's add_callback(). This means listeners are
+always called from the same thread and don't need any locking.
+"""
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class EventBus:
+  def __init__(self, scheduler):
+    """
+    scheduler is a thread-safe function which takes a callback and arranges
+    for it to be called from the delivery thread
+    """
+    self.scheduler = scheduler
+    self.lock = threading.Lock()
+    self.pending = []
+    self.listeners = []
+
+  def subscribe(self, listener):
+    """Adds a listener, it's called with each event (a dict)"""
+    self.listeners.append(listener)
+
+  def post(self, namespace, zone, data, source=None):
+    """
+    Posts an event, safe to call from any thread.
+      namespace = See PROTOCOL.md, for example zone.volume.state
+      zone      = Zone which the event relates to, None if it's for everyone
+      data      = The event data
+      source    = Remote which caused this event, None if unsolicited
+    """
+    event = {"namespace" : namespace, "zone" : zone, "source" : source, "data" : data}
+    with self.lock:
+      self.pending.append(event)
+      schedule = len(self.pending) == 1
+    if schedule:
+      self.scheduler(self.deliver)
+
+  def deliver(self):
+    """Delivers all pending events, called by the scheduler"""
+    with self.lock:
+      batch = self.pending
+      self.pending = []
+    for event in batch:
+      for listener in self.listeners:
+        try:
+          listener(event)
+        except:
+          logger.exception("Listener failed to handle event %s", event["namespace"])
@@ -0,0 +1,160 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Listening socket handling for restarts without downtime.
+
+Listening sockets can be inherited, either from systemd socket activation
+(see extras/multiremote.socket) or from a previous multiRemote process.
+Both use the LISTEN_FDS/LISTEN_PID protocol, sockets start at fd 3.
+
+A running server can start its own replacement with spawnSuccessor(). The
+new process gets the listening sockets plus a pipe it writes to once it's
+serving. Since the sockets are never closed, connections made in the
+meantime wait in the backlog instead of being refused.
+
+Runtime state (which scenes are active and so on) is handed over in a
+temporary file, see saveState() and inheritedState().
+"""
+import os
+import sys
+import json
+import fcntl
+import socket
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+LISTEN_FDS_START = 3
+SO_DOMAIN = getattr(socket, "SO_DOMAIN", 39) # Linux
+
+def inheritedSockets():
+  """Returns the listening sockets passed to us, if any"""
+  if os.environ.get("LISTEN_PID", None) != str(os.getpid()):
+    return []
+  try:
+    count = int(os.environ.get("LISTEN_FDS", 0))
+  except ValueError:
+    return []
+  # Don't pass these on to anything we start
+  for key in ["LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"]:
+    os.environ.pop(key, None)
+
+  result = []
+  for fd in range(LISTEN_FDS_START, LISTEN_FDS_START + count):
+    sock = socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM)
+    family = sock.getsockopt(socket.SOL_SOCKET, SO_DOMAIN)
+    if family != socket.AF_INET:
+      sock.close()
+      sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+    os.close(fd) # fromfd() duplicates it
+    sock.setblocking(0)
+    result.append(sock)
+  logger.info("Using %d inherited listening socket(s)", len(result))
+  return result
+
+def listenSockets(port, address):
+  """Returns inherited sockets, or new ones bound to address and port"""
+  result = inheritedSockets()
+  if len(result) == 0:
+    from tornado.netutil import bind_sockets
+    result = bind_sockets(port, address)
+  return result
+
+def saveState(state):
+  """Writes state to a temporary file for our successor, returns its name"""
+  fd, filename = tempfile.mkstemp(prefix="multiremote-state-", suffix=".json")
+  with os.fdopen(fd, "w") as file:
+    json.dump(state, file)
+  return filename
+
+def inheritedState():
+  """Returns the state saved by the previous instance, if any"""
+  filename = os.environ.pop("MULTIREMOTE_STATE", None)
+  if filename is None:
+    return None
+  try:
+    with open(filename) as file:
+      return json.load(file)
+  except:
+    logger.exception("Unable to load state from previous instance")
+    return None
+  finally:
+    discardState(filename)
+
+def discardState(filename):
+  """Removes a state file, if it's still around"""
+  try:
+    os.unlink(filename)
+  except OSError:
+    pass
+
+def spawnSuccessor(sockets, stateFile=None):
+  """
+  Starts a new instance of ourselves (same arguments) which takes over
+  sockets and the state in stateFile. Returns (pid, fd) where fd becomes
+  readable once the new process is serving, or at EOF if it died.
+  """
+  ready, readyWrite = os.pipe()
+  pid = os.fork()
+  if pid != 0:
+    os.close(readyWrite)
+    return (pid, ready)
+
+  # Child, first move everything out of the way of the target numbers
+  try:
+    fds = [fcntl.fcntl(s.fileno(), fcntl.F_DUPFD, 100) for s in sockets]
+    fds.append(fcntl.fcntl(readyWrite, fcntl.F_DUPFD, 100))
+    for i, fd in enumerate(fds):
+      os.dup2(fd, LISTEN_FDS_START + i)
+    os.closerange(LISTEN_FDS_START + len(fds), os.sysconf("SC_OPEN_MAX"))
+
+    os.environ["LISTEN_PID"] = str(os.getpid())
+    os.environ["LISTEN_FDS"] = str(len(sockets))
+    os.environ["MULTIREMOTE_READY_FD"] = str(LISTEN_FDS_START + len(sockets))
+    if stateFile is not None:
+      os.environ["MULTIREMOTE_STATE"] = stateFile
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+  finally:
+    os._exit(1)
+
+def signalReady():
+  """
+  Tells whoever started us that we're serving, either the previous
+  instance or systemd (when using Type=notify)
+  """
+  fd = os.environ.pop("MULTIREMOTE_READY_FD", None)
+  if fd is not None:
+    try:
+      os.write(int(fd), "1")
+      os.close(int(fd))
+    except OSError:
+      logger.exception("Unable to tell previous instance we're ready")
+  notify("READY=1\nMAINPID=%d" % os.getpid())
+
+def notify(state):
+  """Sends state to systemd, if we're started by it"""
+  address = os.environ.get("NOTIFY_SOCKET", None)
+  if address is None:
+    return
+  if address.startswith("@"):
+    address = "\0" + address[1:]
+  try:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.sendto(state, address)
+    sock.close()
+  except socket.error:
+    logger.exception("Unable to notify systemd")
@@ -0,0 +1,75 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Keeps the last message of persistent namespaces (flag.persist in
+PROTOCOL.md) per zone, so they can be replayed to remotes joining the zone.
+
+The cache for a zone is reset when its scene changes, with the exception of
+the namespaces which describe the zone itself.
+
+NOT thread-safe, should only be used from the IOLoop.
+"""
+import collections
+from namespace import NamespaceMatcher
+
+class LastValueCache:
+  PERSIST = [
+    "scene.state",
+    "zone.state",
+    "zone.state.subzone",
+    "zone.volume.state",
+    "media.*",
+  ]
+  RESET_BY = "scene.state"
+  KEEP_ON_RESET = ["zone.state", "zone.state.subzone"]
+
+  def __init__(self):
+    self.persist = NamespaceMatcher()
+    for namespace in self.PERSIST:
+      self.persist.subscribe(namespace, True)
+    self.zones = {}
+
+  def update(self, zone, message):
+    """
+    Remembers message if it's persistent. zone is the zone the message was
+    sent to, None if it was sent to everyone.
+    """
+    namespace = message["namespace"]
+    if len(self.persist.match(namespace)) == 0:
+      return
+
+    if zone not in self.zones:
+      self.zones[zone] = collections.OrderedDict()
+    cache = self.zones[zone]
+    if namespace == self.RESET_BY:
+      for key in list(cache.keys()):
+        if key[0] not in self.KEEP_ON_RESET:
+          del cache[key]
+
+    # Messages for everyone may still be about a specific zone
+    key = (namespace, message["data"].get("zone", None))
+    cache.pop(key, None)
+    cache[key] = message
+
+  def get(self, zone):
+    """Returns the messages to replay for a remote joining zone"""
+    result = list(self.zones.get(None, {}).values())
+    if zone is not None:
+      result.extend(self.zones.get(zone, {}).values())
+    return result
+
+  def __len__(self):
+    return sum(len(c) for c in self.zones.values())
@@ -0,0 +1,74 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Latest-wins execution of absolute value commands.
+
+Dragging a slider produces a burst of "set to X" commands, where only the
+last one matters. Calls are run one at a time per key (driver and zone) by
+a worker thread. While one is running, newer calls replace whatever is
+waiting, so once it finishes only the most recent value is sent. What the
+last call returned is kept per key, see getLast().
+"""
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LatestWins:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.pending = {}
+    self.workers = set()
+    self.last = {}
+
+  def submit(self, key, function, *args):
+    """
+    Queues function(*args) for key, replacing anything not yet started.
+    Returns immediately, True if something was replaced.
+    """
+    with self.lock:
+      replaced = key in self.pending
+      self.pending[key] = (function, args)
+      if key in self.workers:
+        return replaced
+      self.workers.add(key)
+    thread = threading.Thread(target=self.run, args=(key,), name="LatestWins %s" % repr(key))
+    thread.daemon = True
+    thread.start()
+    return replaced
+
+  def run(self, key):
+    while True:
+      with self.lock:
+        if key not in self.pending:
+          self.workers.discard(key)
+          return
+        (function, args) = self.pending.pop(key)
+      try:
+        result = function(*args)
+      except:
+        logger.exception("Failed to execute for %s", repr(key))
+        result = None
+      with self.lock:
+        self.last[key] = result
+
+  def getLast(self, key):
+    """Returns what the most recently completed call for key returned"""
+    with self.lock:
+      return self.last.get(key, None)
+
+  def __len__(self):
+    return len(self.pending)
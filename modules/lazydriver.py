@@ -0,0 +1,64 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Stands in for a driver which hasn't been created yet.
+
+The driver is created by calling factory the first time it's used, which
+for scene-only drivers is when a scene first needs them. Drivers which
+didn't finish in time during startup use a factory which waits for them.
+"""
+import time
+import threading
+import logging
+from startup import STARTUP
+
+logger = logging.getLogger(__name__)
+
+class LazyDriver(object):
+  def __init__(self, name, factory, how="lazy"):
+    self._name = name
+    self._factory = factory
+    self._how = how
+    self._lock = threading.Lock()
+    self._driver = None
+    self._eventCallback = None
+
+  def _get(self):
+    with self._lock:
+      if self._driver is None:
+        started = time.time()
+        self._driver = self._factory()
+        elapsed = time.time() - started
+        STARTUP.addDriver(self._name, elapsed, self._how)
+        logger.info("Created %s driver %s in %dms", self._how, self._name, elapsed * 1000)
+        if self._eventCallback is not None and hasattr(self._driver, "setEventCallback"):
+          self._driver.setEventCallback(self._eventCallback)
+      return self._driver
+
+  def isCreated(self):
+    return self._driver is not None
+
+  def setEventCallback(self, callback):
+    """Kept until the driver is created, so asking doesn't create it"""
+    with self._lock:
+      if self._driver is None:
+        self._eventCallback = callback
+        return
+    if hasattr(self._driver, "setEventCallback"):
+      self._driver.setEventCallback(callback)
+
+  def __getattr__(self, name):
+    return getattr(self._get(), name)
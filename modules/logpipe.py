@@ -0,0 +1,112 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Asynchronous logging.
+
+Log records are put on a queue by the thread logging them and written to
+stdout or the log file by a background thread, so slow storage (like an SD
+card) doesn't add to request latency. If the queue fills up, records are
+dropped rather than blocking.
+
+Also allows changing the level of individual subsystems (loggers) at
+runtime.
+"""
+import logging
+import threading
+import Queue
+
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+class QueueHandler(logging.Handler):
+  """Puts records on a queue, formatting the message right away"""
+  def __init__(self, queue):
+    logging.Handler.__init__(self)
+    self.queue = queue
+    self.dropped = 0
+
+  def emit(self, record):
+    try:
+      # Arguments may change after this call, so resolve them now
+      record.msg = record.getMessage()
+      record.args = None
+      if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+      self.queue.put_nowait(record)
+    except Queue.Full:
+      self.dropped += 1
+    except:
+      self.handleError(record)
+
+class LogPipeline:
+  def __init__(self, filename=None, level=logging.INFO, format=None, size=10000):
+    """
+    Replaces any handlers on the root logger with a queue which is drained
+    by a background thread writing to filename (or stdout if None)
+    """
+    self.queue = Queue.Queue(size)
+    if filename is None:
+      self.target = logging.StreamHandler()
+    else:
+      self.target = logging.FileHandler(filename)
+    self.target.setFormatter(logging.Formatter(format))
+    self.handler = QueueHandler(self.queue)
+
+    root = logging.getLogger('')
+    root.handlers = [self.handler]
+    root.setLevel(level)
+
+    self.thread = threading.Thread(target=self.run, name="LogPipeline")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def run(self):
+    while True:
+      record = self.queue.get(True)
+      if record is None:
+        break
+      try:
+        self.target.handle(record)
+      except:
+        pass
+
+  def stop(self):
+    """Writes everything still queued and stops the background thread"""
+    self.queue.put(None)
+    self.thread.join(5)
+    self.target.flush()
+
+  def getLevels(self):
+    """Returns the level of the root logger and all known subsystems"""
+    result = {"root" : logging.getLevelName(logging.getLogger('').level)}
+    for name in sorted(logging.Logger.manager.loggerDict):
+      logger = logging.Logger.manager.loggerDict[name]
+      if isinstance(logger, logging.Logger):
+        result[name] = logging.getLevelName(logger.getEffectiveLevel())
+    return result
+
+  def setLevel(self, subsystem, level):
+    """
+    Changes the level of a subsystem, for example "drivers" or
+    "modules.router". Returns False if level is invalid.
+    """
+    level = level.upper()
+    if level not in LEVELS:
+      return False
+    if subsystem == "root":
+      subsystem = ''
+    logging.getLogger(subsystem).setLevel(getattr(logging, level))
+    return True
@@ -0,0 +1,115 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Helps finding memory leaks in long running instances.
+
+Take a snapshot, let the server run for a while and then ask for the
+difference. When tracemalloc is available (Python 3.4+) the difference is
+per source line, otherwise it's the change in number of live objects per
+type, as seen by the garbage collector.
+
+Components also register the size of their internal structures (number of
+subscribers, remote states, cached events, etc) so growth can be spotted
+without taking snapshots.
+"""
+import gc
+import time
+import threading
+import logging
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+logger = logging.getLogger(__name__)
+
+class MemoryInspector:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.sources = {}
+    self.baseline = None
+    self.taken = None
+
+  def addSource(self, name, function):
+    """Registers a function returning the size of a structure"""
+    self.sources[name] = function
+
+  def sizes(self):
+    """Returns the current size of all registered structures"""
+    result = {}
+    for name in self.sources:
+      try:
+        result[name] = self.sources[name]()
+      except:
+        logger.exception("Unable to get size of %s", name)
+        result[name] = None
+    return result
+
+  def countTypes(self):
+    counts = {}
+    for obj in gc.get_objects():
+      name = type(obj).__name__
+      counts[name] = counts.get(name, 0) + 1
+    return counts
+
+  def snapshot(self):
+    """Takes a new baseline to compare against"""
+    with self.lock:
+      if tracemalloc is not None:
+        if not tracemalloc.is_tracing():
+          tracemalloc.start()
+        self.baseline = tracemalloc.take_snapshot()
+      else:
+        gc.collect()
+        self.baseline = self.countTypes()
+      self.taken = time.time()
+
+  def diff(self, limit=25):
+    """
+    Returns the biggest changes since the last snapshot, or None if no
+    snapshot has been taken.
+    """
+    with self.lock:
+      if self.baseline is None:
+        return None
+      result = {"age" : int(time.time() - self.taken), "changes" : []}
+      if tracemalloc is not None:
+        result["method"] = "tracemalloc"
+        current = tracemalloc.take_snapshot()
+        for stat in current.compare_to(self.baseline, "lineno")[:limit]:
+          frame = stat.traceback[0]
+          result["changes"].append({
+            "where" : "%s:%d" % (frame.filename, frame.lineno),
+            "size" : stat.size,
+            "size-diff" : stat.size_diff,
+            "count-diff" : stat.count_diff
+          })
+      else:
+        result["method"] = "gc"
+        gc.collect()
+        current = self.countTypes()
+        diff = []
+        for name in set(current.keys()) | set(self.baseline.keys()):
+          delta = current.get(name, 0) - self.baseline.get(name, 0)
+          if delta != 0:
+            diff.append((name, current.get(name, 0), delta))
+        diff.sort(key=lambda x: abs(x[2]), reverse=True)
+        for name, count, delta in diff[:limit]:
+          result["changes"].append({"type" : name, "count" : count, "count-diff" : delta})
+      return result
+
+MEMORY = MemoryInspector()
@@ -0,0 +1,224 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Lightweight metrics, exposed in Prometheus text format.
+
+Modules create their metrics once at import time using the shared REGISTRY:
+
+  REQUESTS = REGISTRY.counter("multiremote_requests_total", "Requests", ["endpoint"])
+  REQUESTS.labels("zone").inc()
+
+Histograms use fixed buckets, so observing a value only increments
+counters which already exist. Gauges can be backed by a function which is
+called when the metrics are rendered, avoiding any bookkeeping in the
+code being measured.
+
+All updates are thread-safe.
+"""
+import threading
+import bisect
+
+# Suitable for most things measured in seconds in this project
+DEFAULT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+def _escape(value):
+  return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatLabels(names, values, extra=None):
+  pairs = ['%s="%s"' % (n, _escape(v)) for n, v in zip(names, values)]
+  if extra is not None:
+    pairs.append('%s="%s"' % extra)
+  if len(pairs) == 0:
+    return ""
+  return "{" + ",".join(pairs) + "}"
+
+def _formatValue(value):
+  if value == float("inf"):
+    return "+Inf"
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _CounterValue:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.value = 0
+
+  def inc(self, amount=1):
+    with self.lock:
+      self.value += amount
+
+  def set(self, value):
+    with self.lock:
+      self.value = value
+
+  def dec(self, amount=1):
+    self.inc(-amount)
+
+  def get(self):
+    return self.value
+
+class _HistogramValue:
+  def __init__(self, buckets):
+    self.lock = threading.Lock()
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+    i = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      self.counts[i] += 1
+      self.sum += value
+      self.count += 1
+
+  def get(self):
+    """Returns (cumulative bucket counts, sum, count)"""
+    with self.lock:
+      counts = list(self.counts)
+      total = self.sum
+      count = self.count
+    cumulative = []
+    running = 0
+    for c in counts:
+      running += c
+      cumulative.append(running)
+    return (cumulative, total, count)
+
+class _Metric:
+  TYPE = None
+
+  def __init__(self, name, help, labels):
+    self.name = name
+    self.help = help
+    self.labelNames = list(labels or [])
+    self.children = {}
+    self.lock = threading.Lock()
+    if len(self.labelNames) == 0:
+      self.children[()] = self._create()
+
+  def labels(self, *values):
+    """Returns the metric for a specific set of label values"""
+    child = self.children.get(values, None)
+    if child is None:
+      with self.lock:
+        child = self.children.get(values, None)
+        if child is None:
+          child = self._create()
+          self.children[values] = child
+    return child
+
+  def _default(self):
+    return self.children[()]
+
+  def render(self):
+    lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.TYPE)]
+    for values in sorted(self.children.keys()):
+      lines.extend(self._renderChild(values, self.children[values]))
+    return lines
+
+  def _renderChild(self, values, child):
+    return ["%s%s %s" % (self.name, _formatLabels(self.labelNames, values), _formatValue(child.get()))]
+
+class Counter(_Metric):
+  TYPE = "counter"
+
+  def _create(self):
+    return _CounterValue()
+
+  def inc(self, amount=1):
+    self._default().inc(amount)
+
+class Gauge(_Metric):
+  TYPE = "gauge"
+
+  def __init__(self, name, help, labels=None, function=None):
+    self.function = function
+    _Metric.__init__(self, name, help, labels)
+
+  def _create(self):
+    return _CounterValue()
+
+  def set(self, value):
+    self._default().set(value)
+
+  def inc(self, amount=1):
+    self._default().inc(amount)
+
+  def dec(self, amount=1):
+    self._default().dec(amount)
+
+  def _renderChild(self, values, child):
+    if self.function is not None:
+      value = self.function()
+    else:
+      value = child.get()
+    return ["%s%s %s" % (self.name, _formatLabels(self.labelNames, values), _formatValue(value))]
+
+class Histogram(_Metric):
+  TYPE = "histogram"
+
+  def __init__(self, name, help, labels=None, buckets=None):
+    self.buckets = sorted(buckets or DEFAULT_BUCKETS)
+    _Metric.__init__(self, name, help, labels)
+
+  def _create(self):
+    return _HistogramValue(self.buckets)
+
+  def observe(self, value):
+    self._default().observe(value)
+
+  def _renderChild(self, values, child):
+    (counts, total, count) = child.get()
+    lines = []
+    for bound, c in zip(self.buckets + [float("inf")], counts):
+      lines.append("%s_bucket%s %d" % (self.name, _formatLabels(self.labelNames, values, ("le", _formatValue(bound))), c))
+    labels = _formatLabels(self.labelNames, values)
+    lines.append("%s_sum%s %s" % (self.name, labels, repr(total)))
+    lines.append("%s_count%s %d" % (self.name, labels, count))
+    return lines
+
+class Registry:
+  def __init__(self):
+    self.metrics = []
+    self.lock = threading.Lock()
+
+  def _add(self, metric):
+    with self.lock:
+      self.metrics.append(metric)
+    return metric
+
+  def counter(self, name, help, labels=None):
+    return self._add(Counter(name, help, labels))
+
+  def gauge(self, name, help, labels=None, function=None):
+    """If function is provided, it's called to obtain the value when rendering"""
+    return self._add(Gauge(name, help, labels, function))
+
+  def histogram(self, name, help, labels=None, buckets=None):
+    return self._add(Histogram(name, help, labels, buckets))
+
+  def render(self):
+    """Returns all metrics in Prometheus text format"""
+    lines = []
+    for metric in list(self.metrics):
+      try:
+        lines.extend(metric.render())
+      except:
+        # A broken gauge function must not take down the endpoint
+        lines.append("# ERROR rendering %s" % metric.name)
+    return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
@@ -0,0 +1,109 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Matches dotted namespaces (see PROTOCOL.md) against subscriptions.
+
+All subscriptions are kept in one trie, shared by all subscribers, so a
+namespace only needs to be matched once to find everyone interested in it.
+
+Supported patterns:
+  *                       = Everything
+  zone.*                  = Everything below zone (zone.state, zone.volume.state, ...)
+  zone.*.state            = Exactly one level in-between
+  scene.event.unsolicited = Only this namespace
+"""
+
+class NamespaceMatcher:
+  def __init__(self):
+    self.root = self._node()
+    self.patterns = {}
+
+  def _node(self):
+    return {"children" : {}, "exact" : set(), "tail" : set()}
+
+  def subscribe(self, pattern, key):
+    """Subscribes key to pattern, subscribing twice has no effect"""
+    segments = pattern.split(".")
+    node = self.root
+    for s in segments[:-1]:
+      node = node["children"].setdefault(s, self._node())
+    if segments[-1] == "*":
+      node["tail"].add(key)
+    else:
+      node = node["children"].setdefault(segments[-1], self._node())
+      node["exact"].add(key)
+
+    if key not in self.patterns:
+      self.patterns[key] = set()
+    self.patterns[key].add(pattern)
+
+  def unsubscribe(self, pattern, key):
+    """Removes a subscription, branches which become empty are pruned"""
+    segments = pattern.split(".")
+    path = [self.root]
+    for s in segments[:-1]:
+      if s not in path[-1]["children"]:
+        return
+      path.append(path[-1]["children"][s])
+    if segments[-1] == "*":
+      path[-1]["tail"].discard(key)
+    elif segments[-1] in path[-1]["children"]:
+      path.append(path[-1]["children"][segments[-1]])
+      path[-1]["exact"].discard(key)
+    else:
+      return
+
+    # Prune empty nodes, bottom up
+    for i in range(len(path) - 1, 0, -1):
+      node = path[i]
+      if len(node["children"]) or len(node["exact"]) or len(node["tail"]):
+        break
+      parent = path[i-1]
+      for name in parent["children"]:
+        if parent["children"][name] is node:
+          del parent["children"][name]
+          break
+
+    if key in self.patterns:
+      self.patterns[key].discard(pattern)
+      if len(self.patterns[key]) == 0:
+        del self.patterns[key]
+
+  def unsubscribeAll(self, key):
+    """Removes all subscriptions held by key"""
+    for pattern in list(self.patterns.get(key, [])):
+      self.unsubscribe(pattern, key)
+
+  def hasSubscriptions(self, key):
+    return key in self.patterns
+
+  def match(self, namespace):
+    """Returns the set of keys subscribed to namespace"""
+    result = set()
+    self._match(self.root, namespace.split("."), 0, result)
+    return result
+
+  def _match(self, node, segments, i, result):
+    if i == len(segments):
+      result.update(node["exact"])
+      return
+    result.update(node["tail"])
+    child = node["children"].get(segments[i], None)
+    if child is not None:
+      self._match(child, segments, i + 1, result)
+    child = node["children"].get("*", None)
+    if child is not None:
+      self._match(child, segments, i + 1, result)
@@ -1,8 +1,20 @@
 import re
+import imp
+import time
 import importlib
+import threading
 import logging
+from lazydriver import LazyDriver
+from startup import STARTUP
+import drivers
+
+logger = logging.getLogger(__name__)
 
 class SetupParser:
+  # How long to wait for a driver to be created during startup, drivers
+  # which take longer are used once they're done.
+  DRIVER_DEADLINE = 5.0
+
   def __init__(self):
     pass
 
@@ -331,9 +343,20 @@ class SetupParser:
 
     return {'warn' : warn, 'info' : info}
 
-  def instanciate(self, klass, arglist):
+  def hasDriver(self, klass):
+    """Tests if a driver exists without importing it"""
+    try:
+      imp.find_module(klass, drivers.__path__)
+      return True
+    except ImportError:
+      return False
+
+  def findDriver(self, klass):
     module = importlib.import_module('drivers.' + klass)
-    my_class = getattr(module, 'driver' + klass.capitalize())
+    return getattr(module, 'driver' + klass.capitalize())
+
+  def instanciate(self, klass, arglist):
+    my_class = self.findDriver(klass)
 
     args = ''
     for a in arglist:
@@ -342,6 +365,65 @@ class SetupParser:
 
     return eval('my_class(%s)' % args)
 
+  def findSceneOnlyDrivers(self, config):
+    """
+    Returns the devices which are only used by scenes, ie, not by any zone
+    or as part of another device's path. These aren't needed until a scene
+    using them is selected.
+    """
+    used = set()
+    for route in config['ROUTING_TABLE']:
+      for path in config['ROUTING_TABLE'][route]:
+        for item in config['ROUTING_TABLE'][route][path]:
+          used.update(item.keys())
+    for zone in config['ZONE_TABLE'].values():
+      for z in [zone] + zone.get('subzones', {}).values():
+        for kind in ['audio', 'video']:
+          if z.get(kind) is not None:
+            used.add(z[kind].split(':')[0])
+
+    scenes = set([config['SCENE_TABLE'][s]['driver'] for s in config['SCENE_TABLE']])
+    return scenes - used
+
+  def createDrivers(self, config):
+    """
+    Creates the drivers. Scene-only drivers are imported and created on
+    first use, the rest are created in parallel since some do blocking work
+    (DNS lookups, loading IR files). All of them share one DRIVER_DEADLINE,
+    drivers which miss it are used once they're done. Returns False if a
+    driver fails.
+    """
+    lazy = self.findSceneOnlyDrivers(config)
+    pending = {}
+    for item in config['DRIVER_TABLE']:
+      driver, arguments = config['DRIVER_TABLE'][item].items()[0]
+      logger.debug("Loading %s", driver)
+      if not self.hasDriver(driver):
+        logger.error("Device %s uses unknown driver %s", item, driver)
+        return False
+      if item in lazy:
+        config['DRIVER_TABLE'][item] = LazyDriver(item, self.factory(driver, arguments))
+      else:
+        pending[item] = _DriverLoader(item, self.factory(driver, arguments))
+
+    deadline = time.time() + self.DRIVER_DEADLINE
+    for item in pending:
+      loader = pending[item]
+      loader.join(max(0, deadline - time.time()))
+      if loader.isAlive():
+        logger.warning("Driver %s is taking a long time to start, continuing without it", item)
+        config['DRIVER_TABLE'][item] = LazyDriver(item, loader.wait, "late")
+      elif loader.error is not None:
+        logger.error("Driver %s failed to start: %s", item, loader.error)
+        return False
+      else:
+        STARTUP.addDriver(item, loader.elapsed, "parallel")
+        config['DRIVER_TABLE'][item] = loader.driver
+    return True
+
+  def factory(self, klass, arglist):
+    return lambda: self.instanciate(klass, arglist)
+
   def load(self, filename, config):
     handler = None
     temp = {}
@@ -358,25 +440,26 @@ class SetupParser:
       'zone [a-zA-Z0-9]+ ?: ?.+' : self.handleZone,
     }
 
-    with open(filename) as file:
-      l=0
-      for line in file:
-        line = line.strip()
-        l += 1
-        if line == "" or line[0] == '#':
-          continue
-
-        #Use existing handler if we have one
-        if handler is not None and handler(config, line, temp) == False:
-          handler = None
-
-        # No handler? No problem, find one!
-        if handler is None:
-          handler = self.findHandler(line, tree)
-          temp = {}
-          if handler is None or handler(config, line, temp) == False:
-            print 'ERROR: Unable to parse "%s" at line %d' % (line, l)
-            return False
+    with STARTUP.phase("parse configuration"):
+      with open(filename) as file:
+        l=0
+        for line in file:
+          line = line.strip()
+          l += 1
+          if line == "" or line[0] == '#':
+            continue
+
+          #Use existing handler if we have one
+          if handler is not None and handler(config, line, temp) == False:
+            handler = None
+
+          # No handler? No problem, find one!
+          if handler is None:
+            handler = self.findHandler(line, tree)
+            temp = {}
+            if handler is None or handler(config, line, temp) == False:
+              print 'ERROR: Unable to parse "%s" at line %d' % (line, l)
+              return False
 
     warn = []
     info = []
@@ -392,18 +475,49 @@ class SetupParser:
       return False
 
     for w in warn:
-      logging.warn(w)
+      logger.warn(w)
     for i in info:
-      logging.info(i)
+      logger.info(i)
 
     # Lets instanciate the drivers now that we know we're good to go!
-    for item in config['DRIVER_TABLE']:
-      for k in config['DRIVER_TABLE'][item]:
-        driver = k
-        arguments = config['DRIVER_TABLE'][item][k]
-
-        logging.debug("Loading " + driver)
-        config['DRIVER_TABLE'][item] = self.instanciate(driver, arguments)
-        break
-
-    return True
+    with STARTUP.phase("create drivers"):
+      return self.createDrivers(config)
+
+class _DriverLoader(threading.Thread):
+  """Creates a driver in the background"""
+  # How long the first use of a late driver waits for it, later uses don't
+  # wait at all. It's used from the IOLoop, so this must stay short.
+  WAIT_TIMEOUT = 1.0
+
+  def __init__(self, name, factory):
+    threading.Thread.__init__(self, name="Load " + name)
+    self.driverName = name
+    self.daemon = True
+    self.factory = factory
+    self.driver = None
+    self.error = None
+    self.elapsed = 0
+    self.waited = False
+    self.start()
+
+  def run(self):
+    started = time.time()
+    try:
+      self.driver = self.factory()
+    except Exception as e:
+      logger.exception("Unable to create driver %s", self.driverName)
+      self.error = e
+    self.elapsed = time.time() - started
+
+  def wait(self):
+    """
+    Returns the driver once it's created. Raises if it failed or still
+    isn't done, the caller's command fails but can be retried later.
+    """
+    self.join(0 if self.waited else self.WAIT_TIMEOUT)
+    self.waited = True
+    if self.isAlive():
+      raise RuntimeError("Driver %s is still starting" % self.driverName)
+    if self.error is not None:
+      raise self.error
+    return self.driver
@@ -0,0 +1,110 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+On-demand profiling of the running server.
+
+Two modes are available:
+
+- sample: a background thread looks at the stack of every thread at a
+  fixed interval and counts them. Overhead is low and all threads
+  (IOLoop, Router, SSDP, drivers) are covered. The result is in the
+  collapsed stack format used by flamegraph.pl and speedscope.
+- cprofile: runs cProfile on the IOLoop thread (which also serves all the
+  HTTP requests) and returns the pstats report.
+
+Only one session can run at a time.
+"""
+import sys
+import os
+import time
+import threading
+import logging
+import StringIO
+
+logger = logging.getLogger(__name__)
+
+MAX_DURATION = 120
+MIN_INTERVAL = 0.001
+
+class Profiler:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.running = False
+
+  def acquire(self):
+    """Returns False if a session is already running"""
+    with self.lock:
+      if self.running:
+        return False
+      self.running = True
+      return True
+
+  def release(self):
+    with self.lock:
+      self.running = False
+
+  def sample(self, duration, interval, threads=None):
+    """
+    Samples the stacks of all threads (or only those whose names are listed
+    in threads) for duration seconds. Blocks, so call it from a thread of
+    its own. Returns the stacks in collapsed format, most common first.
+    """
+    own = threading.current_thread().ident
+    counts = {}
+    samples = 0
+    end = time.time() + duration
+    while time.time() < end:
+      names = dict([(t.ident, t.name) for t in threading.enumerate()])
+      for ident, frame in sys._current_frames().items():
+        if ident == own:
+          continue
+        name = names.get(ident, "Thread-%d" % ident)
+        if threads and name not in threads:
+          continue
+        stack = []
+        while frame is not None:
+          code = frame.f_code
+          stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+          frame = frame.f_back
+        stack.append(name)
+        key = ";".join(reversed(stack))
+        counts[key] = counts.get(key, 0) + 1
+      samples += 1
+      time.sleep(interval)
+
+    logger.info("Profiler took %d samples over %.1fs", samples, duration)
+    result = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+    return "\n".join(["%s %d" % (k, v) for k, v in result]) + "\n"
+
+  def startProfile(self):
+    """Starts cProfile on the calling thread and returns the profile"""
+    import cProfile
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+  def stopProfile(self, profile, sort="cumulative", limit=100):
+    """Stops profile (from the same thread) and returns the pstats report"""
+    import pstats
+    profile.disable()
+    if sort not in pstats.Stats.sort_arg_dict_default:
+      sort = "cumulative"
+    output = StringIO.StringIO()
+    stats = pstats.Stats(profile, stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+PROFILER = Profiler()
@@ -0,0 +1,217 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Storage of registered remotes.
+
+Two backends are available:
+
+- json: Everything is kept in memory and written to remotes.json in the
+  background. Fine for a household.
+- sqlite: Like json, everything is kept in memory, but it's persisted in an
+  SQLite database (keyed on UUID) where only the remotes which changed are
+  written, in the background. The database is only read at startup. Use it
+  when there are thousands of remotes, since a change no longer rewrites
+  all of them. The first time it's used, any existing remotes.json is
+  imported (and renamed to remotes.json.migrated).
+
+Both return copies of the stored data, so callers are free to modify them.
+"""
+import os
+import json
+import sqlite3
+import threading
+import logging
+from metrics import REGISTRY
+from writebehind import WriteBehind, writeAtomic
+
+logger = logging.getLogger(__name__)
+
+SAVES = REGISTRY.counter("multiremote_remotes_saves_total", "Times the remote registry has been written to disk")
+
+JSON_FILENAME = "remotes.json"
+SQLITE_FILENAME = "remotes.db"
+
+def loadJSON(filename):
+  """
+  Loads the remote object.
+  !DOES NOT VALIDATE THE DATA!
+  """
+  try:
+    jdata = open(filename)
+    data = json.load(jdata)
+    jdata.close()
+  except:
+    logger.exception("Unable to load %s", filename)
+    return {}
+  return data
+
+class JSONRegistry:
+  def __init__(self, filename=JSON_FILENAME):
+    self.filename = filename
+    self.lock = threading.Lock()
+    self.remotes = loadJSON(filename)
+    self.writer = WriteBehind(self.write)
+
+  def has(self, uuid):
+    return uuid in self.remotes
+
+  def get(self, uuid):
+    remote = self.remotes.get(uuid, None)
+    if remote is None:
+      return None
+    return dict(remote)
+
+  def put(self, uuid, remote):
+    with self.lock:
+      self.remotes[uuid] = dict(remote)
+    self.writer.schedule()
+
+  def remove(self, uuid):
+    with self.lock:
+      self.remotes.pop(uuid, None)
+    self.writer.schedule()
+
+  def list(self):
+    return self.remotes.keys()
+
+  def all(self):
+    with self.lock:
+      return dict([(u, dict(r)) for u, r in self.remotes.items()])
+
+  def flush(self):
+    """Saves any pending changes right away"""
+    self.writer.flush()
+
+  def write(self):
+    """Writes the remote object, unless it's empty"""
+    with self.lock:
+      data = json.dumps(self.remotes)
+      empty = len(self.remotes) == 0
+    if empty:
+      logger.debug("No remotes in system, will not save")
+      return
+
+    try:
+      writeAtomic(self.filename, data)
+      SAVES.inc()
+    except:
+      logger.exception("Unable to save %s", self.filename)
+
+  def __len__(self):
+    return len(self.remotes)
+
+class SQLiteRegistry:
+  def __init__(self, filename=SQLITE_FILENAME, migrate=JSON_FILENAME):
+    self.filename = filename
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(filename, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("""CREATE TABLE IF NOT EXISTS remotes (
+                         uuid TEXT PRIMARY KEY,
+                         name TEXT,
+                         description TEXT,
+                         zone TEXT)""")
+    self.db.commit()
+    if migrate is not None and os.path.isfile(migrate):
+      self.migrate(migrate)
+
+    # Lookups are served from memory, the database only sees the changes
+    self.remotes = {}
+    for row in self.db.execute("SELECT uuid, name, description, zone FROM remotes"):
+      self.remotes[row[0]] = self._remote(row[1:])
+    self.dirty = set()
+    self.writer = WriteBehind(self.write)
+
+  def migrate(self, filename):
+    """One-time import of remotes from the json backend"""
+    remotes = loadJSON(filename)
+    with self.db:
+      for uuid in remotes:
+        self.db.execute("INSERT OR IGNORE INTO remotes VALUES (?, ?, ?, ?)", self._row(uuid, remotes[uuid]))
+    os.rename(filename, filename + ".migrated")
+    logger.info("Imported %d remotes from %s", len(remotes), filename)
+
+  def _row(self, uuid, remote):
+    return (uuid, remote.get("name", None), remote.get("description", None), remote.get("zone", None))
+
+  def _remote(self, row):
+    return {"name" : row[0], "description" : row[1], "zone" : row[2]}
+
+  def has(self, uuid):
+    return uuid in self.remotes
+
+  def get(self, uuid):
+    remote = self.remotes.get(uuid, None)
+    if remote is None:
+      return None
+    return dict(remote)
+
+  def put(self, uuid, remote):
+    with self.lock:
+      self.remotes[uuid] = dict(remote)
+      self.dirty.add(uuid)
+    self.writer.schedule()
+
+  def remove(self, uuid):
+    with self.lock:
+      self.remotes.pop(uuid, None)
+      self.dirty.add(uuid)
+    self.writer.schedule()
+
+  def list(self):
+    return self.remotes.keys()
+
+  def all(self):
+    with self.lock:
+      return dict([(u, dict(r)) for u, r in self.remotes.items()])
+
+  def flush(self):
+    """Saves any pending changes right away"""
+    self.writer.flush()
+
+  def write(self):
+    """Writes the remotes which changed since the last write in one transaction"""
+    with self.lock:
+      changed = [(uuid, self.remotes.get(uuid, None)) for uuid in self.dirty]
+      self.dirty = set()
+    if len(changed) == 0:
+      return
+
+    try:
+      with self.db:
+        for uuid, remote in changed:
+          if remote is None:
+            self.db.execute("DELETE FROM remotes WHERE uuid = ?", (uuid,))
+          else:
+            self.db.execute("INSERT OR REPLACE INTO remotes VALUES (?, ?, ?, ?)", self._row(uuid, remote))
+      SAVES.inc()
+    except:
+      logger.exception("Unable to save %s", self.filename)
+      # Try again with the next change
+      with self.lock:
+        self.dirty.update([uuid for uuid, remote in changed])
+
+  def __len__(self):
+    return len(self.remotes)
+
+BACKENDS = {
+  "json" : JSONRegistry,
+  "sqlite" : SQLiteRegistry,
+}
+
+def createRegistry(backend):
+  """Creates a registry, backend is one of BACKENDS"""
+  return BACKENDS[backend]()
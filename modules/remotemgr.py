@@ -16,10 +16,11 @@
 # along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import json
-import base64
 import uuid
 import logging
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
 
 """
 Remote registration and management is handled in this class.
@@ -29,50 +30,28 @@ by multiRemote.
 An app can range from web page (using multiRemote-UX), dedicated iOS/Android
 native app or indeed another server.
 
-Each remote can have states associated with it, but these are not saved
-by the system. They are most definitely volatile :)
+Registrations are kept by a registry backend (see registry.py). Each remote
+can also have states associated with it, but these are not saved by the
+system. They are most definitely volatile :)
 """
 class RemoteManager:
-  FILENAME="remotes.json"
-
-  def __init__(self):
+  def __init__(self, changes, store):
     """
-    Initializes our list of recognized remotes
+    Initializes our list of recognized remotes, changes is the ChangeLog
+    which gets told about registrations and state changes and store is the
+    registry backend
     """
-    self.REMOTES = self.load()
+    self.CHANGES = changes
+    self.STORE = store
     self.STATE = {}
+    self.ZONES = {}
+    REGISTRY.gauge("multiremote_remotes_registered", "Registered remotes", function=lambda: len(self.STORE))
 
-  def load(self):
-    """
-    Loads the remote object.
-    !DOES NOT VALIDATE THE DATA!
-    """
-    data = {}
-    try:
-      jdata = open(self.FILENAME)
-      data = json.load(jdata)
-      jdata.close()
-    except:
-      logging.exception("Unable to load " + self.FILENAME)
-      return {}
-
-    return data;
-
-  def save(self):
+  def flush(self):
     """
-    Saves the remote object, unless it's empty
+    Saves any pending changes right away
     """
-    if len(self.REMOTES) == 0:
-      logging.debug("No remotes in system, will not save")
-      return
-
-    try:
-      jdata = open(self.FILENAME, "w")
-      jdata.write(json.dumps(self.REMOTES))
-      jdata.close()
-    except:
-      logging.exception("Unable to save " + self.FILENAME)
-      return
+    self.STORE.flush()
 
   def register(self, name, desc, zone, existing=None):
     """
@@ -84,58 +63,79 @@ class RemoteManager:
     elif self.has(existing):
       id = existing
     else:
-      logging.error("Tried to update " + existing + " but it's not in database")
+      logger.error("Tried to update %s but it's not in database", existing)
       return None
 
-    self.REMOTES[id] = {"name" : name, "description" : desc, "zone" : zone}
-    self.save()
+    self.STORE.put(id, {"name" : name, "description" : desc, "zone" : zone})
+    self.CHANGES.changed("remote", id)
     return id;
 
   def unregister(self, uuid):
     """
     Removes a remote based on its UUID.
     """
-    if uuid in self.REMOTES:
-      self.REMOTES.pop(uuid, None)
+    if self.STORE.has(uuid):
+      self.STORE.remove(uuid)
+      self._moveZone(uuid, self.get(uuid, "active-zone"), None)
+      self.STATE.pop(uuid, None)
+      self.CHANGES.changed("remote", uuid)
     else:
-      logging.warning("Trying to remove " + uuid + " which does not exist")
-    self.save()
+      logger.warning("Trying to remove %s which does not exist", uuid)
 
   def list(self):
     """
     Returns an array of UUIDs
     """
-    ret = []
-    for r in self.REMOTES:
-      ret.append(r)
-    return ret
+    return self.STORE.list()
 
   def describe(self, uuid):
     """
     Returns a representation of the selected remote or None if
     it does not exist.
     """
-    if uuid in self.REMOTES:
-      return self.REMOTES[uuid]
-    return None
+    return self.STORE.get(uuid)
+
+  def describeAll(self):
+    """
+    Returns the representation of all remotes, by UUID
+    """
+    return self.STORE.all()
+
+  def listByZone(self, zone):
+    """
+    Returns the UUIDs of remotes currently attached to zone
+    """
+    return list(self.ZONES.get(zone, []))
 
   def has(self, uuid):
     """
     Tests if UUID is a valid remote
     """
-    return uuid in self.REMOTES
+    return self.STORE.has(uuid)
 
   def set(self, uuid, key, value):
-    if not uuid in self.REMOTES:
-      logging.warning("set() called on non-existant remote: " + uuid)
+    if not self.has(uuid):
+      logger.warning("set() called on non-existant remote: %s", uuid)
       return
     if not uuid in self.STATE:
       self.STATE[uuid] = {}
+    if key == "active-zone":
+      self._moveZone(uuid, self.STATE[uuid].get(key, None), value)
     self.STATE[uuid][key] = value
+    self.CHANGES.changed("remote", uuid)
+
+  def _moveZone(self, uuid, old, new):
+    """Keeps the index of remotes per active zone up to date"""
+    if old is not None and old in self.ZONES:
+      self.ZONES[old].discard(uuid)
+      if len(self.ZONES[old]) == 0:
+        del self.ZONES[old]
+    if new is not None:
+      self.ZONES.setdefault(new, set()).add(uuid)
 
   def get(self, uuid, key, default=None):
     if not uuid in self.STATE:
       return default
     if not key in self.STATE[uuid]:
       return default
-    return self.STATE[uuid][key]
\ No newline at end of file
+    return self.STATE[uuid][key]
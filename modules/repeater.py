@@ -0,0 +1,90 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Press-and-hold auto repeat.
+
+Calls a function at a given rate (per second) until stopped. The rate can
+accelerate, it's multiplied by acceleration every second the button is held,
+up to maxRate. As a safety net, repeating stops by itself after limit
+seconds in case the release never arrives.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_RATE = 20.0
+MAX_TIME = 30.0
+
+class Repeater:
+  def __init__(self, ioloop, function, rate=5.0, acceleration=1.0, maxRate=MAX_RATE, limit=MAX_TIME, onStop=None):
+    """
+    function is called without arguments and should return False (or
+    raise) if it failed, which stops the repeat. onStop is called with the repeater when
+    it stops on its own (failure or limit reached).
+    """
+    self.ioloop = ioloop
+    self.function = function
+    self.maxRate = min(max(float(maxRate), 0.1), MAX_RATE)
+    self.rate = min(max(float(rate), 0.1), self.maxRate)
+    self.acceleration = max(float(acceleration), 1.0)
+    self.limit = min(float(limit), MAX_TIME)
+    self.onStop = onStop
+    self.count = 0
+    self.failed = False
+    self.timeout = None
+    self.running = False
+
+  def start(self):
+    self.running = True
+    self.started = time.time()
+    self.tick()
+
+  def stop(self):
+    self.running = False
+    if self.timeout is not None:
+      self.ioloop.remove_timeout(self.timeout)
+      self.timeout = None
+
+  def tick(self):
+    self.timeout = None
+    if not self.running:
+      return
+    try:
+      result = self.function()
+    except:
+      logger.exception("Repeated command raised")
+      result = False
+    self.count += 1
+    if result is None or result is False:
+      logger.debug("Repeat failed after %d calls", self.count)
+      self.failed = True
+      self.finish()
+      return
+    held = time.time() - self.started
+    if held >= self.limit:
+      logger.warning("Repeat held for %ds, stopping", held)
+      self.finish()
+      return
+
+    interval = 1.0 / self.rate
+    self.rate = min(self.rate * (self.acceleration ** interval), self.maxRate)
+    self.timeout = self.ioloop.call_later(interval, self.tick)
+
+  def finish(self):
+    self.stop()
+    if self.onStop is not None:
+      self.onStop(self)
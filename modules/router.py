@@ -22,6 +22,14 @@ import threading
 import Queue
 import time
 import logging
+from metrics import REGISTRY
+from timing import DRIVER_TIMING
+import tracing
+
+logger = logging.getLogger(__name__)
+
+WORK_ORDER_TIME = REGISTRY.histogram("multiremote_router_work_order_seconds", "Time taken to apply a route change")
+DRIVER_ERRORS = REGISTRY.counter("multiremote_driver_errors_total", "Driver calls which raised an exception", ["driver", "operation"])
 
 class Router (threading.Thread):
   DELAY = 30 # delay in seconds
@@ -32,9 +40,10 @@ class Router (threading.Thread):
   CONFIG = None
 
   def __init__(self, config):
-    threading.Thread.__init__(self)
+    threading.Thread.__init__(self, name="Router")
 
     self.CONFIG = config
+    REGISTRY.gauge("multiremote_router_queue_depth", "Route changes waiting to be applied", function=self.workList.qsize)
 
     self.daemon = True
     self.start()
@@ -44,15 +53,52 @@ class Router (threading.Thread):
     Grabs a snapshot of the current state and queues it for
     realization.
     """
-    state = self.CONFIG.getCurrentState()
-    logging.debug("Queuing route change " + repr(state))
-    self.workList.put(state)
+    with tracing.span("Router.updateRoutes"):
+      state = self.CONFIG.getCurrentState()
+    logger.debug("Queuing route change %r", state)
+
+    # Keep the trace (if any) alive until the router is done with it
+    trace = tracing.current()
+    if trace is not None:
+      trace.hold()
+    self.workList.put((state, trace, time.time()))
+
+  def getState(self):
+    """Returns the drivers in use, and their commands"""
+    return dict(self.prevState)
+
+  def restoreState(self, state):
+    """
+    Takes over the drivers in use from a previous process. They're already
+    powered, so they're only told so, not asked to power on again.
+    """
+    self.prevState = dict(state)
+    for d in state:
+      (name, zone) = self.splitDriverZone(d)
+      driver = self.CONFIG.getDriver(name)
+      if driver is None or not hasattr(driver, "assumePower"):
+        continue
+      if zone is None:
+        driver.assumePower(True)
+      else:
+        driver.assumePower(zone, True)
 
   def run(self):
     """Takes care of incoming routing requests"""
     while True:
-      order = self.workList.get(True)
-      self.processWorkOrder(order)
+      (order, trace, queued) = self.workList.get(True)
+      start = time.time()
+      if trace is not None:
+        tracing.activate(trace)
+        trace.addSpan("Router.queue", queued, start)
+      try:
+        with tracing.span("Router.processWorkOrder"):
+          self.processWorkOrder(order)
+      finally:
+        WORK_ORDER_TIME.observe(time.time() - start)
+        if trace is not None:
+          tracing.deactivate()
+          trace.release()
 
   def processWorkOrder(self, order):
     """Figures out what parts that should be kept on, off or updated"""
@@ -60,7 +106,7 @@ class Router (threading.Thread):
     keep_drivers = {}
     inactive_drivers = []
 
-    logging.debug("Processing route change " + repr(order))
+    logger.debug("Processing route change %r", order)
 
     drivers = {}
     for z in order:
@@ -82,9 +128,9 @@ class Router (threading.Thread):
     self.updateDrivers(keep_drivers)
     self.disableDrivers(inactive_drivers)
 
-    logging.debug("Router->On  = " + repr(new_drivers))
-    logging.debug("Router->Upd = " + repr(keep_drivers))
-    logging.debug("Router->Off = " + repr(inactive_drivers))
+    logger.debug("Router->On  = %r", new_drivers)
+    logger.debug("Router->Upd = %r", keep_drivers)
+    logger.debug("Router->Off = %r", inactive_drivers)
 
     """ Store what drivers that are in-use """
     self.prevState = keep_drivers
@@ -93,10 +139,10 @@ class Router (threading.Thread):
     """ Finally, execute any scene specific extras """
     for z in order:
       if "extras" in order[z]:
-        logging.debug(z + " has extras")
+        logger.debug("%s has extras", z)
         for e in order[z]["extras"]:
-          logging.debug(e + " has params " + order[z]["extras"][e])
-          self.CONFIG.getDriver(e).applyExtras(order[z]["extras"][e])
+          logger.debug("%s has params %s", e, order[z]["extras"][e])
+          DRIVER_TIMING.call(e, "applyExtras", self.CONFIG.getDriver(e).applyExtras, order[z]["extras"][e])
 
   def enableDrivers(self, drivers):
     """Powers on drivers and sends list of inital commands"""
@@ -107,19 +153,21 @@ class Router (threading.Thread):
       driver = self.CONFIG.getDriver(name)
       if driver is None:
         continue
-      logging.debug("Enabling %s" % driver)
+      logger.debug("Enabling %s", driver)
       try:
         if zone is None:
-          driver.setPower(True)
+          DRIVER_TIMING.call(name, "setPower(on)", driver.setPower, True)
         else:
-          driver.setPower(zone, True)
+          DRIVER_TIMING.call(name, "setPower(on)", driver.setPower, zone, True)
       except:
-        logging.exception("Driver %s failed to power on" % driver)
+        DRIVER_ERRORS.labels(name, "setPower").inc()
+        logger.exception("Driver %s failed to power on", driver)
       try:
         for cmd in drivers[d]:
-          driver.handleCommand(zone, cmd, None)
+          DRIVER_TIMING.call(name, cmd, driver.handleCommand, zone, cmd, None)
       except:
-        logging.exception("Driver %s failed during initial command setup" % driver)
+        DRIVER_ERRORS.labels(name, "handleCommand").inc()
+        logger.exception("Driver %s failed during initial command setup", driver)
 
   def disableDrivers(self, drivers):
     """Powers off drivers"""
@@ -130,14 +178,15 @@ class Router (threading.Thread):
       driver = self.CONFIG.getDriver(name)
       if driver is None:
         continue
-      logging.debug("Disabling %s" % driver)
+      logger.debug("Disabling %s", driver)
       try:
         if zone is None:
-          driver.setPower(False)
+          DRIVER_TIMING.call(name, "setPower(off)", driver.setPower, False)
         else:
-          driver.setPower(zone, False)
+          DRIVER_TIMING.call(name, "setPower(off)", driver.setPower, zone, False)
       except:
-        logging.error("Driver %s failed to power off" % driver)
+        DRIVER_ERRORS.labels(name, "setPower").inc()
+        logger.error("Driver %s failed to power off", driver)
 
   def updateDrivers(self, drivers):
     """Sends new list of commands to drivers"""
@@ -148,12 +197,13 @@ class Router (threading.Thread):
       driver = self.CONFIG.getDriver(name)
       if driver is None:
         continue
-      logging.debug("Updating %s" % driver)
+      logger.debug("Updating %s", driver)
       try:
         for cmd in drivers[d]:
-          driver.handleCommand(zone, cmd, None)
+          DRIVER_TIMING.call(name, cmd, driver.handleCommand, zone, cmd, None)
       except:
-        logging.error("Driver %s failed to update state" % driver)
+        DRIVER_ERRORS.labels(name, "handleCommand").inc()
+        logger.error("Driver %s failed to update state", driver)
 
   def splitDriverZone(self, driver):
     """Splits drivers with zoning support into two parts"""
@@ -0,0 +1,57 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Outgoing message queue for a single remote connection.
+
+Messages can be queued with a key, in which case any message with the same
+key that hasn't been sent yet is replaced. This is used for state messages
+where only the latest value matters (volume level, scene, etc).
+
+The queue is bounded, push() returns False once the limit is exceeded so
+the owner can decide to drop the connection.
+"""
+import collections
+
+class SendQueue:
+  def __init__(self, limit):
+    self.limit = limit
+    self.pending = collections.OrderedDict()
+    self.serial = 0
+    self.coalesced = 0
+
+  def push(self, message, key=None):
+    """
+    Queues message, replacing any pending message with the same key.
+    Returns False if the queue now holds more than the limit.
+    """
+    if key is None:
+      self.serial += 1
+      key = (None, self.serial)
+    elif key in self.pending:
+      # Remove it so the new message is sent in order with other messages
+      del self.pending[key]
+      self.coalesced += 1
+    self.pending[key] = message
+    return len(self.pending) <= self.limit
+
+  def drain(self):
+    """Returns all pending messages in order and empties the queue"""
+    result = list(self.pending.values())
+    self.pending.clear()
+    return result
+
+  def __len__(self):
+    return len(self.pending)
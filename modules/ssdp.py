@@ -27,12 +27,18 @@ import socket
 import threading
 import time
 import struct
-import ipaddress
-import netifaces
 import uuid
 import logging
 import json
 import os.path
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SEARCHES = REGISTRY.counter("multiremote_ssdp_searches_total", "M-SEARCH requests received")
+RESPONSES = REGISTRY.counter("multiremote_ssdp_responses_total", "M-SEARCH requests answered")
+NOTIFIES = REGISTRY.counter("multiremote_ssdp_notify_total", "NOTIFY messages sent")
+ERRORS = REGISTRY.counter("multiremote_ssdp_errors_total", "Exceptions in the SSDP loop")
 
 class SSDPHandler (threading.Thread):
   CONFIGFILE = "ssdp-info.json"
@@ -47,7 +53,7 @@ class SSDPHandler (threading.Thread):
 
   """
   def __init__(self, location, port, notifyInterval=15, listen=''):
-    threading.Thread.__init__(self)
+    threading.Thread.__init__(self, name="SSDP")
     self.daemon = True
     self.listen = listen
     self.location = location
@@ -55,6 +61,7 @@ class SSDPHandler (threading.Thread):
     self.notifyInterval = notifyInterval
     self.urn = 'urn:sensenet-nu:service:multiRemote:1'
     self.usn = None
+    self.running = True
 
     self.load()
     if self.usn is None:
@@ -72,7 +79,7 @@ class SSDPHandler (threading.Thread):
       if "usn" in data:
         self.usn = data["usn"]
     except:
-      logging.exception("Unable to load " + self.CONFIGFILE)
+      logger.exception("Unable to load %s", self.CONFIGFILE)
 
   def save(self):
     data = {
@@ -84,7 +91,7 @@ class SSDPHandler (threading.Thread):
       jdata.write(json.dumps(data))
       jdata.close()
     except:
-      logging.exception("Unable to save " + self.CONFIGFILE)
+      logger.exception("Unable to save %s", self.CONFIGFILE)
       return
 
   def getUSN(self):
@@ -100,6 +107,8 @@ class SSDPHandler (threading.Thread):
     self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 4)
 
     self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    # Allows a replacement process to start listening before we're gone
+    self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     self.listener.bind((self.listen, 1900))
 
     request = struct.pack('4sL', socket.inet_aton('239.255.255.250'), socket.INADDR_ANY)
@@ -112,7 +121,7 @@ class SSDPHandler (threading.Thread):
     self._initSSDP()
 
     nextNotify = 0
-    while True:
+    while self.running:
       try:
         if nextNotify < time.time():
           self.sendNotify()
@@ -120,16 +129,27 @@ class SSDPHandler (threading.Thread):
         data, sender = self.listener.recvfrom(1400)
         data = data.split('\r\n')
         if data[0] == 'M-SEARCH * HTTP/1.1':
-          #logging.debug('Search request from: ' + repr(sender))
+          #logger.debug('Search request from: ' + repr(sender))
+          SEARCHES.inc()
           self.handleSearch(sender, data)
       except socket.timeout:
         pass # Ignore, it's by design
       except:
-        logging.exception('Got an exception in main read loop')
+        ERRORS.inc()
+        logger.exception('Got an exception in main read loop')
         # Reinit SSDP just-in-case
         self._initSSDP()
+    self.listener.close()
+    self.sender.close()
+
+  def stop(self):
+    """Stops answering, takes up to a second"""
+    self.running = False
 
   def resolveHost(self, sender):
+    # Only needed once someone is looking for us
+    import ipaddress
+    import netifaces
     for i in netifaces.interfaces():
       ii = netifaces.ifaddresses(i)[netifaces.AF_INET][0]
       if ipaddress.ip_address(unicode(sender)) in ipaddress.ip_network(unicode(ii['addr'] + '/' + ii['netmask']), strict=False):
@@ -154,6 +174,7 @@ class SSDPHandler (threading.Thread):
     msg += '\r\n'
 
     self.sender.sendto(msg, ('239.255.255.250', 1900))
+    NOTIFIES.inc()
 
   def sendResponse(self, sender):
     host = self.resolveHost(sender[0])
@@ -172,6 +193,7 @@ class SSDPHandler (threading.Thread):
     msg += '\r\n'
 
     self.sender.sendto(msg, sender)
+    RESPONSES.inc()
 
   def generateXML(self):
     result = """<?xml version="1.0" encoding="UTF-8"?>
@@ -0,0 +1,76 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Keeps track of where time goes while starting up, per phase (parsing the
+configuration, creating drivers, etc) and per driver. The report is logged
+once the server is up and running.
+"""
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _Phase:
+  def __init__(self, report, name):
+    self.report = report
+    self.name = name
+
+  def __enter__(self):
+    self.started = time.time()
+    return self
+
+  def __exit__(self, type, value, tb):
+    self.report.addPhase(self.name, time.time() - self.started)
+    return False
+
+class StartupReport:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.started = time.time()
+    self.phases = []
+    self.drivers = {}
+
+  def phase(self, name):
+    """Use as "with STARTUP.phase(name):" to time a phase"""
+    return _Phase(self, name)
+
+  def addPhase(self, name, elapsed):
+    with self.lock:
+      self.phases.append((name, elapsed))
+
+  def addDriver(self, name, elapsed, how):
+    """how describes how the driver was created (parallel, lazy, late)"""
+    with self.lock:
+      self.drivers[name] = (elapsed, how)
+
+  def report(self):
+    with self.lock:
+      return {
+        "total-ms" : int((time.time() - self.started) * 1000),
+        "phases" : [{"name" : n, "ms" : int(e * 1000)} for n, e in self.phases],
+        "drivers" : dict([(n, {"ms" : int(e * 1000), "how" : h}) for n, (e, h) in self.drivers.items()])
+      }
+
+  def log(self):
+    report = self.report()
+    logger.info("Startup took %dms", report["total-ms"])
+    for phase in report["phases"]:
+      logger.info("  %-24s %6dms", phase["name"], phase["ms"])
+    for name in sorted(report["drivers"], key=lambda n: report["drivers"][n]["ms"], reverse=True):
+      logger.info("  driver %-17s %6dms (%s)", name, report["drivers"][name]["ms"], report["drivers"][name]["how"])
+
+STARTUP = StartupReport()
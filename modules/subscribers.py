@@ -0,0 +1,89 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Keeps track of connected remotes (event subscribers) indexed by the zone
+they're attached to, so events for a zone can be delivered without looking
+at every connection.
+
+A subscriber is any object with a remoteId attribute, a remote may have
+more than one connection.
+
+NOT thread-safe, should only be used from the IOLoop.
+"""
+
+class SubscriberIndex:
+  def __init__(self):
+    self.subscribers = []
+    self.zones = {}
+    self.remotes = {}
+    self.zoneOf = {}
+
+  def add(self, subscriber, zone):
+    """Adds a subscriber which is attached to zone (or None)"""
+    self.subscribers.append(subscriber)
+    if subscriber.remoteId not in self.remotes:
+      self.remotes[subscriber.remoteId] = []
+    self.remotes[subscriber.remoteId].append(subscriber)
+    self._attach(subscriber, zone)
+
+  def remove(self, subscriber):
+    """Removes a subscriber, ignored if it's unknown"""
+    if subscriber not in self.subscribers:
+      return
+    self.subscribers.remove(subscriber)
+    self._detach(subscriber)
+    self.remotes[subscriber.remoteId].remove(subscriber)
+    if len(self.remotes[subscriber.remoteId]) == 0:
+      del self.remotes[subscriber.remoteId]
+
+  def moveRemote(self, remoteId, zone):
+    """Updates the zone for all connections belonging to a remote"""
+    for subscriber in self.remotes.get(remoteId, []):
+      self._detach(subscriber)
+      self._attach(subscriber, zone)
+
+  def forZone(self, zone):
+    """Returns the subscribers attached to zone"""
+    return list(self.zones.get(zone, []))
+
+  def forRemote(self, remoteId):
+    """Returns the connections of a remote"""
+    return list(self.remotes.get(remoteId, []))
+
+  def getZone(self, subscriber):
+    return self.zoneOf.get(subscriber, None)
+
+  def _attach(self, subscriber, zone):
+    self.zoneOf[subscriber] = zone
+    if zone is None:
+      return
+    if zone not in self.zones:
+      self.zones[zone] = []
+    self.zones[zone].append(subscriber)
+
+  def _detach(self, subscriber):
+    zone = self.zoneOf.pop(subscriber, None)
+    if zone is None:
+      return
+    self.zones[zone].remove(subscriber)
+    if len(self.zones[zone]) == 0:
+      del self.zones[zone]
+
+  def __iter__(self):
+    return iter(list(self.subscribers))
+
+  def __len__(self):
+    return len(self.subscribers)
@@ -0,0 +1,148 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Measures how long calls into drivers take.
+
+Every call is recorded per driver and command, both in the cumulative
+histogram exposed by /metrics and in a rolling histogram covering the last
+couple of windows (so old spikes eventually go away). Each call is also
+recorded as a span in the current trace (if any). Calls slower than
+the threshold are also kept, with arguments and outcome, in a ring buffer.
+
+Use the shared DRIVER_TIMING:
+
+  DRIVER_TIMING.call("receiver", "volume-up", driver.handleCommand, "1", "volume-up", None)
+"""
+import threading
+import collections
+import bisect
+import time
+from metrics import REGISTRY
+import tracing
+
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class _RollingHistogram:
+  """Keeps the current and the previous window, with the slowest call of each"""
+  def __init__(self, window):
+    self.window = window
+    self.rotated = time.time()
+    self.current = [0] * (len(BUCKETS) + 1)
+    self.previous = [0] * (len(BUCKETS) + 1)
+    self.currentMax = 0.0
+    self.previousMax = 0.0
+
+  def observe(self, value, now):
+    if now - self.rotated > self.window * 2:
+      self.previous = [0] * (len(BUCKETS) + 1)
+      self.current = [0] * (len(BUCKETS) + 1)
+      self.previousMax = 0.0
+      self.currentMax = 0.0
+      self.rotated = now
+    elif now - self.rotated > self.window:
+      self.previous = self.current
+      self.current = [0] * (len(BUCKETS) + 1)
+      self.previousMax = self.currentMax
+      self.currentMax = 0.0
+      self.rotated = now
+    self.current[bisect.bisect_left(BUCKETS, value)] += 1
+    self.currentMax = max(self.currentMax, value)
+
+  def describe(self):
+    counts = [a + b for a, b in zip(self.current, self.previous)]
+    count = sum(counts)
+    result = {
+      "count" : count,
+      "max-ms" : int(max(self.currentMax, self.previousMax) * 1000),
+      "buckets" : dict(("le-%s" % b, c) for b, c in zip(BUCKETS + ["inf"], counts)),
+    }
+    for p in [50, 90, 99]:
+      result["p%d-ms" % p] = self._percentile(counts, count, p)
+    return result
+
+  def _percentile(self, counts, count, p):
+    """Upper bound (in ms) of the bucket holding the percentile"""
+    if count == 0:
+      return None
+    target = count * p / 100.0
+    running = 0
+    for bound, c in zip(BUCKETS, counts):
+      running += c
+      if running >= target:
+        return int(bound * 1000)
+    return None
+
+class DriverTiming:
+  def __init__(self, threshold=0.5, size=100, window=300):
+    """
+    threshold = Calls taking longer than this (seconds) are logged as slow
+    size      = Number of slow calls to keep
+    window    = Seconds covered by each rolling window
+    """
+    self.threshold = threshold
+    self.window = window
+    self.lock = threading.Lock()
+    self.rolling = {}
+    self.slow = collections.deque(maxlen=size)
+    self.histogram = REGISTRY.histogram("multiremote_driver_call_seconds", "Time spent in driver calls", ["driver", "call"], BUCKETS)
+
+  def call(self, driver, operation, function, *args):
+    """
+    Calls function with args, timing it as operation (usually the
+    command) on driver. Exceptions are passed on to the caller.
+    """
+    start = time.time()
+    outcome = "exception"
+    try:
+      with tracing.span("Driver.call", driver=driver, call=operation):
+        result = function(*args)
+      outcome = "failed" if result is None or result is False else "ok"
+      return result
+    finally:
+      now = time.time()
+      self.record(driver, operation, now - start, now, args, outcome)
+
+  def record(self, driver, operation, elapsed, now, args, outcome):
+    self.histogram.labels(driver, operation).observe(elapsed)
+    with self.lock:
+      key = (driver, operation)
+      if key not in self.rolling:
+        self.rolling[key] = _RollingHistogram(self.window)
+      self.rolling[key].observe(elapsed, now)
+      if elapsed >= self.threshold:
+        self.slow.append({
+          "time" : now,
+          "driver" : driver,
+          "call" : operation,
+          "arguments" : repr(args),
+          "duration-ms" : int(elapsed * 1000),
+          "outcome" : outcome,
+        })
+
+  def report(self):
+    """Returns the rolling histograms and slow calls"""
+    with self.lock:
+      calls = {}
+      for (driver, operation) in self.rolling:
+        calls.setdefault(driver, {})[operation] = self.rolling[(driver, operation)].describe()
+      return {
+        "threshold-ms" : int(self.threshold * 1000),
+        "window-s" : self.window,
+        "calls" : calls,
+        "slow" : list(self.slow),
+      }
+
+DRIVER_TIMING = DriverTiming()
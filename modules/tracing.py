@@ -0,0 +1,197 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Lightweight request tracing.
+
+A trace is started for each request and made current for the thread
+handling it. Code along the way records spans:
+
+  with tracing.span("Core.checkConflict"):
+    ...
+
+or by decorating a function with @tracing.traced("Core.checkConflict").
+Spans are no-ops when there is no current trace.
+
+A trace can be handed to another thread (like the Router) by calling
+hold() before passing it on, activate() in the other thread and release()
+when done. A trace is complete once everyone holding it has released it.
+It's then stored in TRACES, unless it recorded no spans and was quick (like
+polling /state or /metrics), so those don't push out the interesting ones.
+"""
+import threading
+import collections
+import functools
+import time
+import uuid
+
+_local = threading.local()
+
+class _NullSpan:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+  def __init__(self, trace, name, attrs):
+    self.trace = trace
+    self.name = name
+    self.attrs = attrs
+
+  def __enter__(self):
+    self.depth = getattr(_local, "depth", 0)
+    _local.depth = self.depth + 1
+    self.start = time.time()
+    return self
+
+  def __exit__(self, kind, value, tb):
+    end = time.time()
+    _local.depth = self.depth
+    if kind is not None:
+      self.attrs["error"] = repr(value)
+    self.trace.addSpan(self.name, self.start, end, self.depth, self.attrs)
+    return False
+
+class Trace:
+  def __init__(self, name, buffer):
+    self.id = uuid.uuid4().hex[:16]
+    self.name = name
+    self.buffer = buffer
+    self.start = time.time()
+    self.end = None
+    self.spans = []
+    self.refs = 1
+    self.lock = threading.Lock()
+
+  def addSpan(self, name, start, end, depth=0, attrs=None):
+    """Records a span which has already happened"""
+    with self.lock:
+      self.spans.append((name, start, end, depth, threading.current_thread().name, attrs))
+
+  def hold(self):
+    """Keeps the trace open while another thread works on it"""
+    with self.lock:
+      self.refs += 1
+
+  def release(self):
+    """Done with the trace, once everyone has released it, it's stored"""
+    with self.lock:
+      self.refs -= 1
+      if self.refs > 0:
+        return
+      self.end = time.time()
+    self.buffer.add(self)
+
+  def summary(self):
+    end = self.end or time.time()
+    return {
+      "id" : self.id,
+      "name" : self.name,
+      "start" : self.start,
+      "duration-ms" : round((end - self.start) * 1000, 3),
+      "spans" : len(self.spans),
+    }
+
+  def export(self):
+    """Returns the trace as a waterfall, spans ordered by start time"""
+    result = self.summary()
+    with self.lock:
+      spans = sorted(self.spans, key=lambda s: s[1])
+    result["spans"] = []
+    for (name, start, end, depth, thread, attrs) in spans:
+      span = {
+        "name" : name,
+        "offset-ms" : round((start - self.start) * 1000, 3),
+        "duration-ms" : round((end - start) * 1000, 3),
+        "depth" : depth,
+        "thread" : thread,
+      }
+      if attrs:
+        span["attributes"] = attrs
+      result["spans"].append(span)
+    return result
+
+class TraceBuffer:
+  """
+  Keeps the most recently completed traces which recorded spans or took
+  longer than threshold seconds
+  """
+  def __init__(self, size=100, threshold=0.1):
+    self.lock = threading.Lock()
+    self.traces = collections.deque(maxlen=size)
+    self.threshold = threshold
+
+  def add(self, trace):
+    if len(trace.spans) == 0 and trace.end - trace.start < self.threshold:
+      return
+    with self.lock:
+      self.traces.append(trace)
+
+  def list(self):
+    with self.lock:
+      return [t.summary() for t in reversed(self.traces)]
+
+  def get(self, id):
+    with self.lock:
+      for t in self.traces:
+        if t.id == id:
+          return t
+    return None
+
+  def __len__(self):
+    return len(self.traces)
+
+TRACES = TraceBuffer()
+
+def begin(name):
+  """Starts a new trace and makes it current for this thread"""
+  trace = Trace(name, TRACES)
+  activate(trace)
+  return trace
+
+def activate(trace):
+  """Makes trace current for this thread"""
+  _local.trace = trace
+  _local.depth = 0
+
+def deactivate():
+  """Clears the current trace for this thread, returns it"""
+  trace = getattr(_local, "trace", None)
+  _local.trace = None
+  return trace
+
+def current():
+  return getattr(_local, "trace", None)
+
+def span(name, **attrs):
+  """Returns a context manager recording a span in the current trace"""
+  trace = getattr(_local, "trace", None)
+  if trace is None:
+    return _NULL_SPAN
+  return _Span(trace, name, attrs)
+
+def traced(name):
+  """Decorator recording each call of the function as a span"""
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      with span(name):
+        return func(*args, **kwargs)
+    return wrapper
+  return decorator
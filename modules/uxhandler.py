@@ -0,0 +1,143 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Serves the hosted UX (--host) straight from Tornado.
+
+On top of what StaticFileHandler already does (ETags, ranges, chunked
+non-blocking writes), this:
+
+- Serves precompressed variants, file.js.br or file.js.gz, when they exist
+  and the client accepts them. Create them with "brotli" or "gzip -k".
+- Keeps small files in memory, reloading them if they change on disk.
+- Lets HTML be revalidated every time while other assets are cached for
+  CACHE_TIME, or forever if requested with a ?v=<version> argument.
+"""
+import os
+import hashlib
+import collections
+import mimetypes
+import threading
+from tornado.web import StaticFileHandler
+
+CACHE_TIME = 3600
+MEMORY_FILE_LIMIT = 64 * 1024
+MEMORY_TOTAL_LIMIT = 4 * 1024 * 1024
+
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+class _MemoryCache:
+  """
+  Small files as (mtime, data, md5), keyed by absolute path. When full,
+  the least recently used files are dropped to make room.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.files = collections.OrderedDict()
+    self.size = 0
+
+  def get(self, path):
+    stat = os.stat(path)
+    with self.lock:
+      entry = self.files.pop(path, None)
+      if entry is not None:
+        if entry[0] == stat.st_mtime:
+          self.files[path] = entry
+          return entry
+        self.size -= len(entry[1])
+
+    if stat.st_size > MEMORY_FILE_LIMIT:
+      return None
+    with open(path, "rb") as file:
+      data = file.read()
+    entry = (stat.st_mtime, data, hashlib.md5(data).hexdigest())
+
+    with self.lock:
+      old = self.files.pop(path, None)
+      if old is not None:
+        self.size -= len(old[1])
+      while len(self.files) > 0 and self.size + len(data) > MEMORY_TOTAL_LIMIT:
+        evicted = self.files.popitem(last=False)[1]
+        self.size -= len(evicted[1])
+      self.files[path] = entry
+      self.size += len(data)
+    return entry
+
+  def __len__(self):
+    return len(self.files)
+
+CACHE = _MemoryCache()
+
+class UXHandler(StaticFileHandler):
+  def validate_absolute_path(self, root, absolute_path):
+    absolute_path = super(UXHandler, self).validate_absolute_path(root, absolute_path)
+    self.original_path = absolute_path
+    self.encoding = None
+    if absolute_path is None:
+      return None
+
+    accepted = self.request.headers.get("Accept-Encoding", "")
+    for encoding, extension in ENCODINGS:
+      if encoding in accepted and os.path.isfile(absolute_path + extension):
+        self.encoding = encoding
+        return absolute_path + extension
+    return absolute_path
+
+  def set_extra_headers(self, path):
+    self.set_header("Vary", "Accept-Encoding")
+    if self.encoding is not None:
+      self.set_header("Content-Encoding", self.encoding)
+    if self.get_content_type() == "text/html":
+      self.set_header("Cache-Control", "no-cache")
+
+  def get_content_type(self):
+    mime_type, encoding = mimetypes.guess_type(self.original_path)
+    if mime_type is None:
+      return "application/octet-stream"
+    return mime_type
+
+  def get_cache_time(self, path, modified, mime_type):
+    if "v" in self.request.arguments:
+      return self.CACHE_MAX_AGE
+    if self.get_content_type() == "text/html":
+      return 0
+    return CACHE_TIME
+
+  def compute_etag(self):
+    """
+    StaticFileHandler caches the hash of every file for the life of the
+    process, so edits to the UX would never show up
+    """
+    return '"%s"' % self.get_content_version(self.absolute_path)
+
+  @classmethod
+  def get_content(cls, abspath, start=None, end=None):
+    entry = CACHE.get(abspath)
+    if entry is None:
+      return super(UXHandler, cls).get_content(abspath, start, end)
+    return entry[1][start:end]
+
+  @classmethod
+  def get_content_version(cls, abspath):
+    """
+    Small files use the md5 kept by CACHE (which is reloaded on change),
+    larger ones the modification time and size instead of being hashed on
+    every request
+    """
+    entry = CACHE.get(abspath)
+    if entry is not None:
+      return entry[2]
+    stat = os.stat(abspath)
+    return "%x-%x" % (int(stat.st_mtime * 1000), stat.st_size)
@@ -0,0 +1,104 @@
+# This file is part of multiRemote.
+#
+# multiRemote is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+#
+# multiRemote is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with multiRemote.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""
+Write-behind persistence.
+
+Changes are marked with schedule() and written by a background thread once
+things have been quiet for delay seconds, but never later than maxDelay
+seconds after the first change. A burst of changes thus results in a single
+write. flush() writes any pending change right away, use it on shutdown.
+
+writeAtomic() replaces a file without risking a truncated one if we crash
+halfway through.
+"""
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+def writeAtomic(filename, data):
+  """Writes data to a temporary file which then replaces filename"""
+  temp = filename + ".tmp"
+  with open(temp, "w") as file:
+    file.write(data)
+    file.flush()
+    os.fsync(file.fileno())
+  os.rename(temp, filename)
+
+class WriteBehind:
+  def __init__(self, function, delay=1.0, maxDelay=5.0):
+    self.function = function
+    self.delay = delay
+    self.maxDelay = maxDelay
+    self.condition = threading.Condition()
+    self.first = None
+    self.last = None
+    self.writing = False
+
+    self.thread = threading.Thread(target=self.run, name="WriteBehind")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def schedule(self):
+    """Marks that something has changed"""
+    with self.condition:
+      self.last = time.time()
+      if self.first is None:
+        self.first = self.last
+        self.condition.notify_all()
+
+  def flush(self):
+    """
+    Writes now if there's anything pending. Either way, a write which is
+    already in progress has finished when this returns.
+    """
+    with self.condition:
+      while self.writing:
+        self.condition.wait()
+      if self.first is None:
+        return
+      self.first = None
+      self.last = None
+      self.writing = True
+    self.write()
+
+  def write(self):
+    """Calls function, the caller must have set writing"""
+    try:
+      self.function()
+    except:
+      logger.exception("Write-behind failed")
+    finally:
+      with self.condition:
+        self.writing = False
+        self.condition.notify_all()
+
+  def run(self):
+    while True:
+      with self.condition:
+        while self.first is None or self.writing:
+          self.condition.wait()
+        due = min(self.last + self.delay, self.first + self.maxDelay)
+        now = time.time()
+        if now < due:
+          self.condition.wait(due - now)
+          continue
+        self.first = None
+        self.last = None
+        self.writing = True
+      self.write()
@@ -27,8 +27,11 @@ scenes. Attach/Detach will NOT automatically power things on/off but attaching
 to a new scene will automatically detach from the previous.
 """
 
+import sys
+import time
 import logging
 import argparse
+from modules.startup import STARTUP
 
 """ Parse command line """
 parser = argparse.ArgumentParser(description="multiRemote - The future of IoT based remote control for your home", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -37,42 +40,82 @@ parser.add_argument('--debug', action='store_true', default=False, help='Enable
 parser.add_argument('--port', default=5000, type=int, help="Port to listen on")
 parser.add_argument('--listen', metavar="ADDRESS", default="0.0.0.0", help="Address to listen on")
 parser.add_argument('--host', metavar='HTML', default=None, help='If set, use built-in HTTP server to host UX')
+parser.add_argument('--slow-command', metavar='MS', default=500, type=int, help='Driver calls taking longer than this are kept in the slow call log')
+parser.add_argument('--ws-backlog', metavar='MESSAGES', default=200, type=int, help='Disconnect remotes with more than this many unsent event messages')
+parser.add_argument('--registry', choices=['json', 'sqlite'], default='json', help='Where registered remotes are kept, sqlite scales to thousands of remotes (remotes.json is imported the first time)')
+parser.add_argument('--startup-profile', action='store_true', default=False, help='Profile startup until the first request is served, print a report and exit')
 cmdline = parser.parse_args()
 
+if cmdline.startup_profile:
+  import cProfile
+  startupProfile = cProfile.Profile()
+  startupProfile.enable()
+
 """ Setup logging first """
-logging.getLogger('').handlers = []
-if cmdline.debug or True: # Sorry, always full debug for now
-  logging.basicConfig(filename=cmdline.logfile, level=logging.DEBUG, format='%(filename)s@%(lineno)d - %(levelname)s - %(message)s')
+from modules.logpipe import LogPipeline, LEVELS
+if cmdline.debug:
+  logpipe = LogPipeline(cmdline.logfile, logging.DEBUG, '%(filename)s@%(lineno)d - %(levelname)s - %(message)s')
 else:
-  logging.basicConfig(filename=cmdline.logfile, level=logging.INFO, format='%(filename)s@%(lineno)d - %(levelname)s - %(message)s')
+  logpipe = LogPipeline(cmdline.logfile, logging.INFO, '%(filename)s@%(lineno)d - %(levelname)s - %(message)s')
+logger = logging.getLogger("multiremote")
 
 """ Continue with the rest """
 
-from tornado.wsgi import WSGIContainer
-from tornado.ioloop import IOLoop
-from tornado.web import Application, FallbackHandler
-from tornado.websocket import WebSocketHandler
+with STARTUP.phase("import tornado"):
+  from tornado.wsgi import WSGIContainer
+  from tornado.ioloop import IOLoop
+  from tornado.web import Application, FallbackHandler, RequestHandler, RedirectHandler
+  from tornado.websocket import WebSocketHandler, WebSocketClosedError
+  from tornado.concurrent import Future
+  from tornado.httpserver import HTTPServer
+  from tornado import gen
+
+with STARTUP.phase("import flask"):
+  from flask import Flask, jsonify, Response, abort, request, g
 
-from flask import Flask, jsonify, Response, abort, send_from_directory
 import threading
 import Queue
-import time
-
-from modules.remotemgr import RemoteManager
-from modules.router import Router
-from modules.core import Core
-from modules.ssdp import SSDPHandler
-from modules.parser import SetupParser
+import json
+import functools
+import datetime
+import atexit
+import signal
+import os
+
+with STARTUP.phase("import modules"):
+  from modules.remotemgr import RemoteManager
+  from modules.registry import createRegistry
+  from modules.router import Router
+  from modules.core import Core
+  from modules.ssdp import SSDPHandler
+  from modules.parser import SetupParser
+  from modules.changelog import ChangeLog
+  from modules.subscribers import SubscriberIndex
+  from modules.namespace import NamespaceMatcher
+  from modules.sendqueue import SendQueue
+  from modules.eventbus import EventBus
+  from modules.lastvalue import LastValueCache
+  from modules.encoding import EventEncoder
+  from modules.metrics import REGISTRY
+  from modules.timing import DRIVER_TIMING
+  from modules import tracing
+  from modules.profiler import PROFILER, MAX_DURATION, MIN_INTERVAL
+  from modules.memory import MEMORY
+  from modules import handoff
+  from modules import uxhandler
+  from modules.repeater import Repeater
 
 try:
   from flask_cors import CORS # The typical way to import flask-cors
 except ImportError:
   # Path hack allows examples to be run without installation.
-  import os
   parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
   os.sys.path.insert(0, parentdir)
   from flask_cors import CORS
 
+""" Make sure queued log entries are written before exiting """
+atexit.register(logpipe.stop)
+
 """ Disable some logging by-default """
 logging.getLogger("Flask-Cors").setLevel(logging.ERROR)
 logging.getLogger("werkzeug").setLevel(logging.ERROR)
@@ -85,30 +128,253 @@ cors = CORS(app) # Needed to make us CORS compatible
 parser   = SetupParser()
 setup = {}
 if not parser.load("conf/setup.conf", setup):
-  logging.error('Failed to load "setup.conf"')
+  logger.error('Failed to load "setup.conf"')
   sys.exit(255)
 
 if cmdline.host is not None:
   if (":%d" % cmdline.port) not in setup['OPTIONS']["ux-server"] or not setup['OPTIONS']["ux-server"].endswith('/ux') or not setup['OPTIONS']["ux-server"].endswith('/ux/'):
-    logging.warning("You're using hosted UX, make sure \"%s\" points to the right server", setup['OPTIONS']["ux-server"])
-    logging.warning('It should use port %d and end with /ux/' % cmdline.port)
+    logger.warning("You're using hosted UX, make sure \"%s\" points to the right server", setup['OPTIONS']["ux-server"])
+    logger.warning('It should use port %d and end with /ux/', cmdline.port)
 
-remotes = RemoteManager()
-core    = Core(setup, remotes)
-router  = Router(core)
-ssdp    = SSDPHandler(setup['OPTIONS']["ux-server"], cmdline.port)
+with STARTUP.phase("create core"):
+  changes = ChangeLog()
+  DRIVER_TIMING.threshold = cmdline.slow_command / 1000.0
+  remotes = RemoteManager(changes, createRegistry(cmdline.registry))
+  atexit.register(remotes.flush)
+  core    = Core(setup, remotes, changes)
+  router  = Router(core)
+  ssdp    = SSDPHandler(setup['OPTIONS']["ux-server"], cmdline.port)
+  events  = EventBus(IOLoop.instance().add_callback)
+  core.setEventBus(events)
 
 
 """ Tracking information """
-event_subscribers = []
+event_subscribers = SubscriberIndex()
+event_namespaces = NamespaceMatcher()
+event_cache = LastValueCache()
+
+""" Limits for press-and-hold (HOLD over websocket) """
+HOLD_MAX_ACTIVE = 4
+HOLD_MAX_RATE = 20
+HOLD_MAX_TIME = 30
+
+""" Time to first byte we aim for on a Raspberry Pi class board """
+STARTUP_TARGET = 2.0
+
+""" Metrics """
+HTTP_REQUESTS = REGISTRY.counter("multiremote_http_requests_total", "HTTP requests handled", ["endpoint", "code"])
+HTTP_TIME = REGISTRY.histogram("multiremote_http_request_seconds", "Time spent handling HTTP requests", ["endpoint"])
+WS_MESSAGES = REGISTRY.counter("multiremote_websocket_messages_total", "Messages written to remotes")
+WS_COALESCED = REGISTRY.counter("multiremote_websocket_coalesced_total", "Messages replaced by a newer message before being sent")
+WS_DROPPED = REGISTRY.counter("multiremote_websocket_dropped_total", "Remotes disconnected for not keeping up")
+REGISTRY.gauge("multiremote_websocket_subscribers", "Connected remotes", function=lambda: len(event_subscribers))
+
+""" Structures which could grow over time """
+MEMORY.addSource("websocket-subscribers", lambda: len(event_subscribers))
+MEMORY.addSource("websocket-remotes", lambda: len(event_subscribers.remotes))
+MEMORY.addSource("websocket-unsent", lambda: sum([len(s.queue) for s in event_subscribers if s.queue is not None]))
+MEMORY.addSource("namespace-subscribers", lambda: len(event_namespaces.patterns))
+MEMORY.addSource("event-cache", lambda: len(event_cache))
+MEMORY.addSource("event-cache-zones", lambda: len(event_cache.zones))
+MEMORY.addSource("remotes", lambda: len(remotes.STORE))
+MEMORY.addSource("remote-state", lambda: len(remotes.STATE))
+MEMORY.addSource("router-state", lambda: len(router.prevState))
+MEMORY.addSource("changelog", lambda: len(changes.journal))
+MEMORY.addSource("changelog-listeners", lambda: len(changes.listeners))
+MEMORY.addSource("traces", lambda: len(tracing.TRACES))
+MEMORY.addSource("driver-timings", lambda: len(DRIVER_TIMING.rolling))
+MEMORY.addSource("driver-slow-calls", lambda: len(DRIVER_TIMING.slow))
+MEMORY.addSource("ux-cache", lambda: len(uxhandler.CACHE))
+MEMORY.addSource("latest-wins-pending", lambda: len(core.LATEST))
+
+""" Limits for batched commands, delay is the total in milliseconds """
+BATCH_MAX_COMMANDS = 50
+BATCH_MAX_DELAY = 2000
+
+""" How long (in seconds) /changes waits for something to happen """
+CHANGES_TIMEOUT = 30
+CHANGES_MAX_TIMEOUT = 300
 
 def notifySubscribers(zone, message):
-  for subscriber in event_subscribers:
-    if zone is None or core.getRemoteZone(subscriber.remoteId) == zone:
-      logging.info("Informing remote %s about \"%s\"", subscriber.remoteId, message)
-      subscriber.write_message(message)
+  """
+  Sends message to all remotes attached to zone, or all remotes if zone
+  is None. Remotes which have issued SUBSCRIBE only get the message if its
+  namespace matches any of their subscriptions, remotes which haven't get
+  everything. The message is only encoded once regardless of recipients.
+  """
+  if zone is None:
+    recipients = list(event_subscribers)
+  else:
+    recipients = event_subscribers.forZone(zone)
+
+  message["destination"] = zone
+  event_cache.update(zone, message)
+  interested = event_namespaces.match(message["namespace"])
+  recipients = [r for r in recipients if r in interested or not event_namespaces.hasSubscriptions(r)]
+  if len(recipients) == 0:
+    return
+
+  # State messages only need to deliver the latest value
+  key = None
+  if message["namespace"].endswith(".state"):
+    key = (message["namespace"], zone, message["data"].get("zone", None))
+
+  data = json.dumps(message)
+  logger.info("Informing %d remote(s) about \"%s\"", len(recipients), data)
+  for subscriber in recipients:
+    subscriber.send(message, data, key)
+
+def replayEvents(subscriber):
+  """
+  Sends the last known value of persistent events to a remote which just
+  joined a zone, as one batch message.
+  """
+  interested = []
+  for message in event_cache.get(event_subscribers.getZone(subscriber)):
+    if not event_namespaces.hasSubscriptions(subscriber) or subscriber in event_namespaces.match(message["namespace"]):
+      interested.append(message)
+  if len(interested) == 0:
+    return
+  subscriber.send({
+    "type"        : "batch",
+    "namespace"   : "replay",
+    "destination" : event_subscribers.getZone(subscriber),
+    "source"      : None,
+    "data"        : interested,
+  })
+
+""" Message types which don't follow the namespace, older clients rely on type "zone" meaning zone.state """
+EVENT_TYPES = {
+  "zone.state.subzone" : "subzone",
+}
+
+def deliverEvent(event):
+  """Delivers events from the event bus to the remotes"""
+  notifySubscribers(event["zone"], {
+    "type"      : EVENT_TYPES.get(event["namespace"], event["namespace"].split(".")[0]),
+    "namespace" : event["namespace"],
+    "source"    : event["source"],
+    "data"      : event["data"],
+  })
+
+events.subscribe(deliverEvent)
+
+def cacheable(*mutators):
+  """
+  Decorator for read endpoints. Responses are tagged with an ETag based on
+  the state version (and epoch, since versions restart with the process)
+  and a request with a matching If-None-Match is answered
+  with 304 without calling the endpoint at all.
+
+  If any of the arguments named in mutators is set, the call changes state
+  and is always executed.
+  """
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      for m in mutators:
+        if kwargs.get(m, None) is not None:
+          return func(*args, **kwargs)
+      etag = "%s-%d" % (changes.getEpoch(), changes.getVersion())
+      if request.if_none_match.contains(etag):
+        ret = Response(status=304)
+        ret.set_etag(etag)
+        return ret
+      ret = func(*args, **kwargs)
+      ret.set_etag(etag)
+      return ret
+    return wrapper
+  return decorator
+
+def mutating(*arguments):
+  """
+  Decorator for endpoints which change state. While handing over to a new
+  process, which already has a copy of our state, such calls are refused
+  with 503 so the remote retries and reaches the new process instead.
+
+  If arguments are named, only calls where any of them is set are refused.
+  """
+  def decorator(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+      if handingOver and (len(arguments) == 0 or any(kwargs.get(a, None) is not None for a in arguments)):
+        ret = jsonify({"error" : "Server is restarting, try again"})
+        ret.status_code = 503
+        return ret
+      return func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def describeScene(scene):
+  """Returns the public representation of a scene"""
+  return {
+    "scene"       : scene,
+    "name"        : core.getScene(scene)["name"],
+    "description" : core.getScene(scene)["description"],
+    "ux-hint"     : core.getScene(scene)["ux-hint"],
+    "zones"       : core.getSceneZoneUsage(scene),
+    "remotes"     : core.getSceneRemoteUsage(scene),
+  }
+
+def describeZone(zone):
+  """Returns the public representation of a zone"""
+  ret = {
+    "zone"        : zone,
+    "name"        : core.getZone(zone)["name"],
+    "scene"       : core.getZoneScene(zone),
+    "remotes"     : core.getZoneRemoteList(zone),
+    "ux-hint"     : core.getZone(zone)["ux-hint"],
+    "compatible"  : core.getSceneListForZone(zone),
+  }
+  if core.hasSubZones(zone):
+    ret["subzones"] = core.getSubZoneList(zone)
+    ret["subzone"] = core.getSubZone(zone)
+    ret["subzone-default"] = core.getSubZoneDefault(zone)
+  return ret
+
+def describeChanges(since):
+  """
+  Compiles the zones, scenes and remote attachments which have changed since
+  the provided state version. If the version is too old or unknown (None),
+  then everything is returned and "full" is set to True.
+  """
+  version = changes.getVersion()
+  changed = changes.getChanges(since)
+  ret = {"version" : changes.getToken(version), "full" : changed is None, "zones" : {}, "scenes" : {}, "remotes" : {}}
+  if changed is None:
+    changed = {"zone" : core.getZoneList(), "scene" : core.getSceneList(), "remote" : remotes.list()}
+
+  for zone in changed.get("zone", []) + changed.get("subzone", []):
+    if core.hasZone(zone):
+      ret["zones"][zone] = describeZone(zone)
+  for scene in changed.get("scene", []):
+    if core.hasScene(scene):
+      ret["scenes"][scene] = describeScene(scene)
+  for remote in changed.get("remote", []):
+    if remotes.has(remote):
+      ret["remotes"][remote] = {"zone" : core.getRemoteZone(remote)}
     else:
-      logging.info("Skipped remote %s", subscriber.remoteId)
+      ret["remotes"][remote] = None
+  return ret
+
+@app.before_request
+def measureStart():
+  g.started = time.time()
+  tracing.begin("%s %s" % (request.method, request.path))
+
+@app.teardown_request
+def traceEnd(exception):
+  trace = tracing.deactivate()
+  if trace is not None:
+    trace.release()
+
+@app.after_request
+def measureEnd(response):
+  endpoint = request.endpoint or "unknown"
+  HTTP_REQUESTS.labels(endpoint, response.status_code).inc()
+  if hasattr(g, "started"):
+    HTTP_TIME.labels(endpoint).observe(time.time() - g.started)
+  return response
 
 """ Start defining REST end-points """
 @app.route("/")
@@ -120,6 +386,7 @@ def api_root():
 
 @app.route("/scene", defaults={"scene" : None})
 @app.route("/scene/<scene>")
+@cacheable()
 def api_scene(scene):
   """
   Allows probing of the various scenes provided by multiREMOTE
@@ -136,14 +403,7 @@ def api_scene(scene):
 
   if scenes is not None:
     for scene in scenes:
-      ret[scene] = {
-        "scene"       : scene,
-        "name"        : core.getScene(scene)["name"],
-        "description" : core.getScene(scene)["description"],
-        "ux-hint"     : core.getScene(scene)["ux-hint"],
-        "zones"       : core.getSceneZoneUsage(scene),
-        "remotes"     : core.getSceneRemoteUsage(scene),
-      }
+      ret[scene] = describeScene(scene)
     if len(scenes) == 1:
       ret = ret[scenes[0]]
 
@@ -153,6 +413,7 @@ def api_scene(scene):
 
 @app.route("/zone", defaults={"zone" : None})
 @app.route("/zone/<zone>")
+@cacheable()
 def api_zone(zone):
   """
   Allows probing of the various zones provided by multiREMOTE
@@ -169,18 +430,7 @@ def api_zone(zone):
 
   if zones is not None:
     for zone in zones:
-      ret[zone] = {
-        "zone"        : zone,
-        "name"        : core.getZone(zone)["name"],
-        "scene"       : core.getZoneScene(zone),
-        "remotes"     : core.getZoneRemoteList(zone),
-        "ux-hint"     : core.getZone(zone)["ux-hint"],
-        "compatible"  : core.getSceneListForZone(zone),
-      }
-      if core.hasSubZones(zone):
-        ret[zone]["subzones"] = core.getSubZoneList(zone)
-        ret[zone]["subzone"] = core.getSubZone(zone)
-        ret[zone]["subzone-default"] = core.getSubZoneDefault(zone)
+      ret[zone] = describeZone(zone)
     if len(zones) == 1:
       ret = ret[zones[0]]
   ret = jsonify(ret)
@@ -189,6 +439,7 @@ def api_zone(zone):
 
 @app.route("/subzone/<zone>", defaults={"subzone" : None})
 @app.route("/subzone/<zone>/<subzone>")
+@mutating("subzone")
 def api_subzone(zone, subzone):
   """
   Changes the subzone for a specific zone
@@ -203,6 +454,7 @@ def api_subzone(zone, subzone):
   else:
     core.setSubZone(zone, subzone)
     router.updateRoutes()
+    events.post("zone.state.subzone", zone, {"id" : subzone}, None)
     ret["subzone"] = core.getSubZone(zone)
 
   if core.hasSubZones(zone):
@@ -216,6 +468,7 @@ def api_subzone(zone, subzone):
 @app.route("/assign/<zone>", defaults={"scene" : None, "options" : None, "remote" : None})
 @app.route("/assign/<zone>/<remote>/<scene>", defaults={"options" : None})
 @app.route("/assign/<zone>/<remote>/<scene>/<options>")
+@mutating("scene")
 def api_assign(zone, remote, scene, options):
   """
   Options can be either clone or unassign:
@@ -251,8 +504,8 @@ def api_assign(zone, remote, scene, options):
     ret["active"] = core.getZoneScene(zone)
     ret["zone"] = zone
 
-    notifySubscribers(zone, {"type":"scene", "source" : remote, "data": {"scene" : core.getZoneScene(zone) } })
-    notifySubscribers(None, {"type":"zone", "source" : remote, "data": {"zone" : zone, "inuse" : True}})
+    events.post("scene.state", zone, {"scene" : core.getZoneScene(zone)}, remote)
+    events.post("zone.state", None, {"zone" : zone, "inuse" : True}, remote)
 
   ret = jsonify(ret)
   ret.status_code = 200
@@ -261,6 +514,7 @@ def api_assign(zone, remote, scene, options):
 
 @app.route("/unassign", defaults={"zone" : None, "remote" : None})
 @app.route("/unassign/<zone>/<remote>")
+@mutating("remote")
 def api_unassign(zone, remote):
   """
   Removes any scenes assigned to a zone, also resets subzone back to
@@ -273,8 +527,10 @@ def api_unassign(zone, remote):
   else:
     core.clearZoneScene(zone)
     core.clearSubZone(zone)
-    notifySubscribers(zone, {"type":"scene", "source" : remote, "data": {"scene" : None } })
-    notifySubscribers(None, {"type":"zone", "source" : remote, "data": {"zone" : zone, "inuse" : False}})
+    events.post("scene.state", zone, {"scene" : None}, remote)
+    events.post("zone.state", None, {"zone" : zone, "inuse" : False}, remote)
+    if core.hasSubZones(zone):
+      events.post("zone.state.subzone", zone, {"id" : core.getSubZone(zone)}, remote)
 
   ret = jsonify(ret)
   ret.status_code = 200
@@ -286,6 +542,8 @@ def api_unassign(zone, remote):
 @app.route("/attach/<remote>", defaults={"zone" : None, "options" : None})
 @app.route("/attach/<remote>/<zone>", defaults={"options" : None})
 @app.route("/attach/<remote>/<zone>/<options>")
+@mutating("zone")
+@cacheable("zone")
 def api_attach(remote, zone, options):
   """
   Attaches a remote to a zone, so that it can control it
@@ -302,6 +560,9 @@ def api_attach(remote, zone, options):
     if remotes.has(remote):
       if not zone is None:
         core.setRemoteZone(remote, zone)
+        event_subscribers.moveRemote(remote, core.getRemoteZone(remote))
+        for subscriber in event_subscribers.forRemote(remote):
+          replayEvents(subscriber)
         ret["users"] = core.getZoneRemoteList(zone)
       ret["active"] = core.getRemoteZone(remote)
     else:
@@ -312,6 +573,7 @@ def api_attach(remote, zone, options):
   return ret
 
 @app.route("/detach/<remote>")
+@mutating()
 def api_detach(remote):
   """
   Detaches a remote from the selected zone.
@@ -322,14 +584,59 @@ def api_detach(remote):
     "active" : None
   }
   core.clearRemoteZone(remote)
+  event_subscribers.moveRemote(remote, None)
 
   ret = jsonify(ret)
   ret.status_code = 200
   return ret
 
+def checkCommand(lst, category, command):
+  """
+  Validates a command against a list obtained from Core.getRemoteCommands(),
+  returns None if the command can be executed, otherwise an error string.
+  """
+  if category == "zone":
+    if command not in lst["zone"]:
+      return "%s is not a zone command" % command
+  elif category == "scene":
+    if command not in lst["scene"]:
+      return "%s is not a scene command" % command
+  else:
+    return "%s is not a supported category" % category
+  return None
+
+def runCommand(remote, lst, category, command, arguments):
+  """
+  Executes a zone or scene command on behalf of a remote. The command list
+  is provided by the caller so it only needs to be compiled once, even when
+  executing several commands in a row.
+  """
+  ret = {}
+  err = checkCommand(lst, category, command)
+  if err is not None:
+    ret["error"] = err
+  elif category == "zone":
+    result = core.execZoneCommand(remote, command, arguments)
+    if result == False or result == None:
+      ret["error"] = "%s failed" % command
+    elif result == True:
+      ret["result"] = "ok"
+    else:
+      # Advanced driver :) or a queued command, which has its own result
+      ret = result
+      if "result" not in ret:
+        ret["result"] = "ok"
+      logger.debug('Result contains: %r', result)
+  elif core.execSceneCommand(remote, command, arguments):
+    ret["result"] = "ok"
+  else:
+    ret["error"] = "%s failed" % command
+  return ret
+
 @app.route("/command/<remote>", defaults={"command" : None, "arguments" : None, "category" : None})
 @app.route("/command/<remote>/<category>/<command>", defaults={"arguments" : None})
 @app.route("/command/<remote>/<category>/<command>/<arguments>")
+@cacheable("category")
 def api_command(remote, category, command, arguments):
   """
   /command/<remote>
@@ -344,39 +651,58 @@ def api_command(remote, category, command, arguments):
   """
   ret = {}
   lst = core.getRemoteCommands(remote)
-  result = None
 
   if category == None:
     ret["zone"] = core.getRemoteZone(remote)
     ret["commands"] = lst
-  elif category == "zone":
-    if command not in lst["zone"]:
-      ret["error"] = "%s is not a zone command" % command
-    else:
-      result = core.execZoneCommand(remote, command, arguments)
-      if result == False or result == None:
-        ret["error"] = "%s failed" % command
-      elif result == True:
-        ret["result"] = "ok"
-      else:
-        # Advanced driver :)
-        ret = result
-        ret["result"] = "ok"
-        logging.debug('Result contains: ' + repr(result))
-  elif category == "scene":
-    if command not in lst["scene"]:
-      ret["error"] = "%s is not a scene command" % command
-    elif core.execSceneCommand(remote, command, arguments):
-      ret["result"] = "ok"
-    else:
-      ret["error"] = "%s failed" % command
   else:
-    ret["error"] = "%s is not a supported category" % category
+    ret = runCommand(remote, lst, category, command, arguments)
 
   ret = jsonify(ret)
   ret.status_code = 200
   return ret
 
+def checkBatch(remote, body):
+  """
+  Validates a batch (see BatchHandler) before anything is executed. Returns
+  (error response, None) if it's invalid, otherwise (None, commands) where
+  each command has its delay parsed and capped by BATCH_MAX_DELAY.
+  """
+  ret = {}
+  if not isinstance(body, dict) or not isinstance(body.get("commands", None), list):
+    ret["error"] = "Expected a JSON object with a list of commands"
+  elif len(body["commands"]) > BATCH_MAX_COMMANDS:
+    ret["error"] = "Too many commands, limit is %d" % BATCH_MAX_COMMANDS
+  elif not remotes.has(remote):
+    ret["error"] = "No such remote " + remote
+  if "error" in ret:
+    return (ret, None)
+
+  lst = core.getRemoteCommands(remote)
+  errors = []
+  commands = []
+  total = 0
+  for cmd in body["commands"]:
+    if not isinstance(cmd, dict):
+      errors.append({"error" : "Command must be an object"})
+      continue
+    err = checkCommand(lst, cmd.get("category", None), cmd.get("command", None))
+    try:
+      wait = max(int(cmd.get("delay", 0) or 0), 0)
+    except (ValueError, TypeError):
+      err = err or "delay must be a number of milliseconds"
+    if err is not None:
+      errors.append({"error" : err})
+      continue
+    errors.append({})
+    wait = min(wait, BATCH_MAX_DELAY - total)
+    total += wait
+    commands.append((cmd["category"], cmd["command"], cmd.get("arguments", None), wait))
+
+  if any("error" in e for e in errors):
+    return ({"error" : "Batch contains invalid commands", "results" : errors}, None)
+  return (None, commands)
+
 @app.route("/debug")
 def api_debug():
   """
@@ -399,7 +725,169 @@ def api_debug():
   ret.status_code = 200
   return ret
 
+def projectState(state, fields):
+  """
+  Reduces a state snapshot to the requested fields. fields is a list of
+  either sections ("zones") or section.field ("zones.scene") entries.
+  Sections not mentioned are dropped, version is always kept.
+  """
+  sections = {}
+  for f in fields:
+    parts = f.split(".", 1)
+    if parts[0] not in state:
+      continue
+    if len(parts) == 1:
+      sections[parts[0]] = None
+    elif parts[0] not in sections or sections[parts[0]] is not None:
+      sections.setdefault(parts[0], []).append(parts[1])
+
+  ret = {"version" : state["version"]}
+  for section in sections:
+    if sections[section] is None or not isinstance(state[section], dict):
+      ret[section] = state[section]
+    elif section == "remote":
+      ret[section] = dict((k, v) for k, v in state[section].items() if k in sections[section])
+    else:
+      ret[section] = {}
+      for key in state[section]:
+        item = state[section][key]
+        if isinstance(item, dict):
+          item = dict((k, v) for k, v in item.items() if k in sections[section])
+        ret[section][key] = item
+  return ret
+
+@app.route("/state", defaults={"remote" : None})
+@app.route("/state/<remote>")
+@cacheable()
+def api_state(remote):
+  """
+  Returns a snapshot of the whole system in one go, meant for remotes
+  drawing their initial screen. All data is from the same state version.
+
+  If remote is provided, its attached zone and available commands are
+  included as well.
+
+  Use ?fields=zones.name,zones.scene,scenes to only get what's needed,
+  see projectState()
+  """
+  ret = {
+    "version" : changes.getToken(),
+    "zones"   : {},
+    "scenes"  : {},
+    "remotes" : {},
+  }
+  for zone in core.getZoneList():
+    ret["zones"][zone] = describeZone(zone)
+  for scene in core.getSceneList():
+    ret["scenes"][scene] = describeScene(scene)
+  for r in remotes.list():
+    ret["remotes"][r] = {"zone" : core.getRemoteZone(r)}
+
+  if remote is not None:
+    if remotes.has(remote):
+      ret["remote"] = {
+        "uuid"     : remote,
+        "zone"     : core.getRemoteZone(remote),
+        "commands" : core.getRemoteCommands(remote),
+      }
+    else:
+      ret["remote"] = {"error" : "No such remote " + remote}
+
+  fields = request.args.get("fields", None)
+  if fields:
+    ret = projectState(ret, fields.split(","))
+
+  ret = jsonify(ret)
+  ret.status_code = 200
+  return ret
+
+@app.route("/metrics")
+def api_metrics():
+  """
+  Exposes internal counters and timings in Prometheus text format
+  """
+  return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/drivers")
+def api_debug_drivers():
+  """
+  Shows how long calls into the drivers take, per driver and command, over
+  the last couple of windows, as well as the most recent slow calls.
+  """
+  ret = jsonify(DRIVER_TIMING.report())
+  ret.status_code = 200
+  return ret
+
+@app.route("/debug/traces", defaults={"id" : None})
+@app.route("/debug/traces/<id>")
+def api_debug_traces(id):
+  """
+  Lists the most recently completed request traces (only those which
+  recorded spans or were slow), or shows one of them as a waterfall of spans (queue wait, route computation, device calls, etc)
+  """
+  if id is None:
+    ret = {"traces" : tracing.TRACES.list()}
+  else:
+    trace = tracing.TRACES.get(id)
+    if trace is None:
+      ret = {"error" : "No such trace"}
+    else:
+      ret = trace.export()
+  ret = jsonify(ret)
+  ret.status_code = 200
+  return ret
+
+@app.route("/admin/memory", defaults={"action" : None})
+@app.route("/admin/memory/<action>")
+def api_admin_memory(action):
+  """
+  Shows the size of internal structures. Use /admin/memory/snapshot to take
+  a baseline and /admin/memory/diff to see what has grown since then.
+  Requires pin-remote as the pin argument.
+  """
+  ret = {}
+  if not core.checkPin(request.args.get("pin", ""), False):
+    ret["error"] = "Invalid PIN"
+  elif action == "snapshot":
+    MEMORY.snapshot()
+    ret["status"] = "Snapshot taken"
+  elif action == "diff":
+    diff = MEMORY.diff()
+    if diff is None:
+      ret["error"] = "No snapshot taken"
+    else:
+      ret["diff"] = diff
+  elif action is not None:
+    ret["error"] = "Unknown action " + action
+
+  if "error" not in ret:
+    ret["sizes"] = MEMORY.sizes()
+  ret = jsonify(ret)
+  ret.status_code = 200
+  return ret
+
+@app.route("/logging", defaults={"subsystem" : None, "level" : None})
+@app.route("/logging/<subsystem>/<level>")
+def api_logging(subsystem, level):
+  """
+  Lists the log level of all subsystems, or changes the level of one of
+  them (for example /logging/drivers/DEBUG or /logging/modules.router/INFO).
+  Use "root" to change the default level. Requires pin-remote as the pin
+  argument.
+  """
+  ret = {}
+  if not core.checkPin(request.args.get("pin", ""), False):
+    ret["error"] = "Invalid PIN"
+  else:
+    if subsystem is not None and not logpipe.setLevel(subsystem, level):
+      ret["error"] = "Level must be one of " + ", ".join(LEVELS)
+    ret["levels"] = logpipe.getLevels()
+  ret = jsonify(ret)
+  ret.status_code = 200
+  return ret
+
 @app.route("/register/<pin>/<name>/<desc>/<zone>")
+@mutating()
 def api_register(pin, name, desc, zone):
   """
   Allows remotes to register themselves with the system. For registration,
@@ -437,6 +925,7 @@ def api_register(pin, name, desc, zone):
   return ret
 
 @app.route("/unregister/<pin>/<uuid>")
+@mutating()
 def api_unregister(pin, uuid):
   """
   Removes a registered remote from the system, also detaches
@@ -449,7 +938,11 @@ def api_unregister(pin, uuid):
     ret["error"] = "No such remote " + uuid
   else:
     core.clearRemoteZone(uuid)
+    event_subscribers.moveRemote(uuid, None)
     remotes.unregister(uuid)
+    # Don't keep serving a remote which no longer exists
+    for subscriber in event_subscribers.forRemote(uuid):
+      subscriber.close()
     ret["status"] = "Remote has been unregistered"
 
   ret = jsonify(ret)
@@ -458,6 +951,7 @@ def api_unregister(pin, uuid):
 
 @app.route("/remotes", defaults={"uuid": None})
 @app.route("/remotes/<uuid>")
+@cacheable()
 def api_remotes(uuid):
   """
   Lists all registered remotes and which zones they're currently
@@ -467,8 +961,7 @@ def api_remotes(uuid):
   if uuid is None:
     ret = {"remotes" : remotes.list()}
   elif uuid == "*":
-    for r in remotes.list():
-      ret[r] = remotes.describe(r)
+    ret = remotes.describeAll()
   else:
     ret = remotes.describe(uuid)
     if ret is None:
@@ -487,56 +980,558 @@ def api_ssdp():
 @app.route('/ux/', defaults={'path' : None})
 @app.route("/ux/<path:path>")
 def serve_html(path):
-  if cmdline.host is None:
-    logging.warning('Client tried to access UX hosting when not enabled')
-    abort(404)
-  else:
-    if path is None:
-      path = 'index.html'
-    return send_from_directory(cmdline.host, path)
+  """ When hosting is enabled, the UX is served by UXHandler instead """
+  logger.warning('Client tried to access UX hosting when not enabled')
+  abort(404)
 
 class WebSocket(WebSocketHandler):
   def open(self, remoteId):
-    logging.info("Remote %s has connected", remoteId);
+    logger.info("Remote %s has connected", remoteId);
+    self.remoteId = None
     if not remotes.has(remoteId):
-      logging.warning("No such remote registered, close connection");
-      self.finish();
+      logger.warning("No such remote registered, close connection");
+      self.close();
     else:
-      event_subscribers.append(self)
       self.remoteId = remoteId
-      self.subscriptions = []
+      self.queue = SendQueue(cmdline.ws_backlog)
+      self.encoder = EventEncoder(
+        self.get_argument("encoding", "json") == "msgpack",
+        self.get_argument("delta", "0") == "1"
+      )
+      self.flushPending = False
+      self.writing = None
+      self.repeaters = {}
+      event_subscribers.add(self, core.getRemoteZone(remoteId))
+      replayEvents(self)
 
   # TODO: We don't care (for now) about origin
   def check_origin(self, origin):
     return True
 
   def on_message(self, message):
+    if self.remoteId is None:
+      return
     if message.startswith('LOG '):
-      logging.debug('%s DEBUG: %s', self.remoteId, message[4:])
+      logger.debug('%s DEBUG: %s', self.remoteId, message[4:])
     elif message.startswith('SUBSCRIBE '):
-      subscribe = message[10:].lower()
-      if subscribe in self.subscriptions:
-        logging.debug('%s already subcribed to %s', self.remoteId, subscribe)
-      else:
-        logging.debug('%s has subscribed to %s', self.remoteId, subscribe)
-        self.subscriptions.append(subscribe)
+      subscribe = message[10:].strip().lower()
+      logger.debug('%s has subscribed to %s', self.remoteId, subscribe)
+      event_namespaces.subscribe(subscribe, self)
+    elif message.startswith('CMD '):
+      self.handleCommand(message[4:])
+    elif message.startswith('HOLD '):
+      self.handleHold(message[5:])
+    elif message.startswith('RELEASE'):
+      self.handleRelease(message[7:])
+    else:
+      logger.debug("%s sent unknown message: %s", self.remoteId, message)
+
+  def handleCommand(self, data):
+    """
+    Executes a command sent over the websocket, the result is sent back on
+    the same connection, tagged with the id provided by the remote:
+      CMD {"id" : <id>, "category" : "zone|scene", "command" : <command>, "arguments" : <optional>}
+    """
+    cmd = self.parseCommand(data)
+    if cmd is None:
+      return
+
+    trace = tracing.begin("CMD %s/%s" % (cmd.get("category", None), cmd.get("command", None)))
+    try:
+      lst = core.getRemoteCommands(self.remoteId)
+      ret = runCommand(self.remoteId, lst, cmd.get("category", None), cmd.get("command", None), cmd.get("arguments", None))
+    finally:
+      tracing.deactivate()
+      trace.release()
+    self.send({"type" : "result", "id" : cmd.get("id", None), "data" : ret})
+
+  def parseCommand(self, data):
+    try:
+      cmd = json.loads(data)
+    except ValueError:
+      cmd = None
+    if not isinstance(cmd, dict):
+      logger.warning('%s sent invalid command: %s', self.remoteId, data)
+      return None
+    return cmd
+
+  def handleHold(self, data):
+    """
+    Starts repeating a command until RELEASE, the connection closes or
+    HOLD_MAX_TIME has passed:
+      HOLD {"id" : <id>, "category" : "zone|scene", "command" : <command>, "arguments" : <optional>,
+            "rate" : <per second>, "acceleration" : <rate multiplier per second>, "max-rate" : <per second>}
+    The first execution is answered like CMD.
+    """
+    cmd = self.parseCommand(data)
+    if cmd is None:
+      return
+    id = cmd.get("id", None)
+    category = cmd.get("category", None)
+    command = cmd.get("command", None)
+    arguments = cmd.get("arguments", None)
+
+    err = checkCommand(core.getRemoteCommands(self.remoteId), category, command)
+    if err is None and len(self.repeaters) >= HOLD_MAX_ACTIVE and id not in self.repeaters:
+      err = "Too many commands held, limit is %d" % HOLD_MAX_ACTIVE
+    if err is not None:
+      self.send({"type" : "result", "id" : id, "data" : {"error" : err}})
+      return
+    if id in self.repeaters:
+      self.repeaters.pop(id).stop()
+
+    # Resolve once and reuse it until something changes
+    dispatch = {"version" : None, "target" : None}
+    def execute():
+      version = changes.getVersion()
+      if version != dispatch["version"]:
+        dispatch["version"] = version
+        dispatch["target"] = core.resolveCommand(self.remoteId, category, command)
+      return core.execResolved(category, dispatch["target"], command, arguments)
+
+    try:
+      repeater = Repeater(
+        IOLoop.instance(), execute,
+        cmd.get("rate", 5), cmd.get("acceleration", 1), cmd.get("max-rate", HOLD_MAX_RATE),
+        HOLD_MAX_TIME, self.repeatStopped
+      )
+    except (ValueError, TypeError):
+      self.send({"type" : "result", "id" : id, "data" : {"error" : "rate, acceleration and max-rate must be numbers"}})
+      return
+    repeater.id = id
+    self.repeaters[id] = repeater
+    repeater.start()
+    if repeater.failed:
+      self.send({"type" : "result", "id" : id, "data" : {"error" : "%s failed" % command}})
     else:
-      logging.debug("%s sent unknown message: %s", self.remoteId, message)
+      self.send({"type" : "result", "id" : id, "data" : {"result" : "ok"}})
+
+  def handleRelease(self, data):
+    """
+    Stops a held command, RELEASE {"id" : <id>}, or all of them if no id
+    is given. Answered with how many times the command was executed.
+    """
+    if data.strip() == "":
+      for id in self.repeaters.keys():
+        self.releaseHeld(id)
+      return
+    cmd = self.parseCommand(data)
+    if cmd is not None:
+      self.releaseHeld(cmd.get("id", None))
+
+  def releaseHeld(self, id):
+    repeater = self.repeaters.pop(id, None)
+    if repeater is None:
+      self.send({"type" : "result", "id" : id, "data" : {"error" : "Nothing held"}})
+      return
+    repeater.stop()
+    self.send({"type" : "result", "id" : id, "data" : {"result" : "ok", "repeats" : repeater.count}})
+
+  def repeatStopped(self, repeater):
+    """The repeat stopped by itself, because of failure or time limit"""
+    if self.repeaters.get(repeater.id, None) is not repeater:
+      return
+    del self.repeaters[repeater.id]
+    if repeater.failed and repeater.count > 1:
+      self.send({"type" : "result", "id" : repeater.id, "data" : {"error" : "Stopped repeating, command failed", "repeats" : repeater.count}})
+    elif not repeater.failed:
+      self.send({"type" : "result", "id" : repeater.id, "data" : {"error" : "Held too long", "repeats" : repeater.count}})
+
+  def send(self, message, data=None, key=None):
+    """
+    Queues message for the remote, it's sent on the next IOLoop iteration.
+    data is the message already encoded as JSON, if available. Pending
+    messages with the same key are replaced. If the remote isn't keeping
+    up and the backlog grows too large, the connection is closed.
+    """
+    if self.queue is None:
+      return
+    if not self.queue.push((message, data), key):
+      WS_DROPPED.inc()
+      logger.warning("Remote %s has more than %d unsent messages, disconnecting", self.remoteId, cmdline.ws_backlog)
+      self.queue = None
+      self.close()
+      return
+    if not self.flushPending:
+      self.flushPending = True
+      IOLoop.instance().add_callback(self.flushQueue)
+
+  def flushQueue(self):
+    """Writes queued messages, unless the previous write is still in progress"""
+    self.flushPending = False
+    if self.queue is None or self.writing is not None:
+      return
+    WS_COALESCED.inc(self.queue.coalesced)
+    self.queue.coalesced = 0
+    try:
+      for (message, data) in self.queue.drain():
+        WS_MESSAGES.inc()
+        if data is None and self.encoder.isDefault():
+          data = json.dumps(message)
+        (payload, binary) = self.encoder.encode(data, message)
+        self.writing = self.write_message(payload, binary=binary)
+    except WebSocketClosedError:
+      self.queue = None
+      return
+
+    # Older versions of tornado doesn't allow flow control
+    if self.writing is not None:
+      IOLoop.instance().add_future(self.writing, self.flushed)
+
+  def flushed(self, future):
+    self.writing = None
+    if self.queue is not None and len(self.queue) > 0:
+      self.flushQueue()
 
   def on_close(self):
-    logging.info("Remote %s has disconnected", self.remoteId)
+    if self.remoteId is None:
+      return
+    for repeater in self.repeaters.values():
+      repeater.stop()
+    self.repeaters = {}
+    logger.info("Remote %s has disconnected", self.remoteId)
     event_subscribers.remove(self)
+    self.queue = None
+    event_namespaces.unsubscribeAll(self)
+
+class ChangesHandler(RequestHandler):
+  """
+  /changes?since=<version>&timeout=<seconds>
+
+  Returns what has changed since version. If nothing has changed, the request
+  is held until something does or timeout (default 30s) expires. The
+  returned "version" should be provided as since in the next call, a version
+  from another process (or no version at all) gets everything.
+  """
+  def set_default_headers(self):
+    self.set_header("Access-Control-Allow-Origin", "*")
+
+  def initialize(self):
+    self.gone = False
+    self.waiter = None
+
+  @gen.coroutine
+  def get(self):
+    since = changes.parseToken(self.get_argument("since", ""))
+    try:
+      timeout = min(float(self.get_argument("timeout", CHANGES_TIMEOUT)), CHANGES_MAX_TIMEOUT)
+    except ValueError:
+      self.write({"error" : "timeout must be a number"})
+      return
+
+    if since is not None and since == changes.getVersion() and timeout > 0:
+      self.waiter = Future()
+      changes.addListener(self.wake)
+      try:
+        yield gen.with_timeout(datetime.timedelta(seconds=timeout), self.waiter)
+      except gen.TimeoutError:
+        pass
+      finally:
+        changes.removeListener(self.wake)
+
+    if self.gone:
+      return
+    self.write(describeChanges(since))
+
+  def wake(self, version=None):
+    # Can be called from any thread
+    IOLoop.instance().add_callback(self.resolve)
+
+  def resolve(self):
+    if not self.waiter.done():
+      self.waiter.set_result(None)
+
+  def on_connection_close(self):
+    self.gone = True
+    if self.waiter is not None:
+      self.resolve()
+
+class BatchHandler(FallbackHandler):
+  """
+  POST /command/<remote>
+
+  Executes a list of commands in one go. Body is JSON:
+  {
+    "commands" : [
+      {"category" : "zone", "command" : "volume-up", "arguments" : None, "delay" : 0},
+      ...
+    ]
+  }
+  "arguments" and "delay" (milliseconds to wait before executing the
+  command) are optional. The whole batch is validated before anything
+  is executed, if any command is invalid, nothing is executed.
+
+  Returns a "results" list with one entry per command, using the same
+  format as /command/<remote>/<category>/<command>
+
+  Delays are waited out without blocking the IOLoop, which is why this isn't
+  a Flask view. Other methods are passed on to Flask.
+  """
+  def set_default_headers(self):
+    self.set_header("Access-Control-Allow-Origin", "*")
+
+  def prepare(self):
+    if self.request.method != "POST":
+      FallbackHandler.prepare(self)
+
+  @gen.coroutine
+  def post(self, remote):
+    try:
+      body = json.loads(self.request.body)
+    except ValueError:
+      body = None
+    ret, commands = checkBatch(remote, body)
+    if ret is None:
+      ret = {"results" : []}
+      lst = core.getRemoteCommands(remote)
+      for (category, command, arguments, wait) in commands:
+        if wait > 0:
+          yield gen.sleep(wait / 1000.0)
+        trace = tracing.begin("BATCH %s/%s" % (category, command))
+        try:
+          ret["results"].append(runCommand(remote, lst, category, command, arguments))
+        finally:
+          tracing.deactivate()
+          trace.release()
+    self.write(ret)
+
+class MeteredApplication(Application):
+  """
+  Counts the requests handled by Tornado itself (websockets, /changes,
+  batches, the hosted UX, ...) in the same metrics as the Flask ones, using
+  the handler name as endpoint. Requests passed on to Flask never get here
+  since FallbackHandler doesn't log them.
+  """
+  def log_request(self, handler):
+    endpoint = type(handler).__name__
+    HTTP_REQUESTS.labels(endpoint, handler.get_status()).inc()
+    HTTP_TIME.labels(endpoint).observe(handler.request.request_time())
+    super(MeteredApplication, self).log_request(handler)
+
+class ProfileHandler(RequestHandler):
+  """
+  /admin/profile?pin=<pin-remote>&mode=<sample|cprofile>&duration=<seconds>
+
+  Profiles the running server for duration seconds (default 10) and returns
+  the result as text. "sample" (default) returns collapsed stacks of all
+  threads, suitable for flame graphs, and also accepts interval=<seconds>
+  and threads=<name,name>. "cprofile" profiles the IOLoop thread and
+  returns pstats output, sort=<key> selects the ordering.
+  """
+  @gen.coroutine
+  def get(self):
+    if not core.checkPin(self.get_argument("pin", ""), False):
+      self.set_status(403)
+      self.write({"error" : "Invalid PIN"})
+      return
+    mode = self.get_argument("mode", "sample")
+    try:
+      duration = min(float(self.get_argument("duration", 10)), MAX_DURATION)
+      interval = max(float(self.get_argument("interval", 0.01)), MIN_INTERVAL)
+    except ValueError:
+      self.write({"error" : "duration and interval must be numbers"})
+      return
+    if mode not in ["sample", "cprofile"]:
+      self.write({"error" : "mode must be sample or cprofile"})
+      return
+    if not PROFILER.acquire():
+      self.set_status(409)
+      self.write({"error" : "A profiling session is already running"})
+      return
+
+    logger.info("Profiling (%s) for %.1fs", mode, duration)
+    try:
+      if mode == "sample":
+        threads = self.get_argument("threads", None)
+        if threads:
+          threads = threads.split(",")
+        result = Future()
+        def sampler():
+          try:
+            stacks = PROFILER.sample(duration, interval, threads)
+            IOLoop.instance().add_callback(result.set_result, stacks)
+          except Exception as e:
+            IOLoop.instance().add_callback(result.set_exception, e)
+        threading.Thread(target=sampler, name="Profiler").start()
+        output = yield result
+      else:
+        profile = PROFILER.startProfile()
+        try:
+          yield gen.sleep(duration)
+        finally:
+          output = PROFILER.stopProfile(profile, self.get_argument("sort", "cumulative"))
+    finally:
+      PROFILER.release()
+
+    self.set_header("Content-Type", "text/plain")
+    self.write(output)
+
+""" How long to spread reconnects over when handing over to a new process """
+DRAIN_TIME = 10
+""" How long the replacement process gets to start serving before we give up on it """
+HANDOFF_TIMEOUT = 60
+handingOver = False
+
+def describeRuntimeState():
+  """
+  Returns what isn't saved anywhere else (active scenes, subzones, which
+  zone remotes control and which drivers are on) so our replacement can
+  continue where we left off
+  """
+  zones = {}
+  for zone in core.getZoneList():
+    zones[zone] = {"scene" : core.getZoneScene(zone)}
+    if core.hasSubZones(zone):
+      zones[zone]["subzone"] = core.getSubZone(zone)
+  attached = {}
+  for remote in remotes.list():
+    attached[remote] = core.getRemoteZone(remote)
+  return {"zones" : zones, "remotes" : attached, "router" : router.getState()}
+
+def restoreRuntimeState(state):
+  """
+  Picks up the state from describeRuntimeState(), skipping anything which
+  no longer exists since the configuration may have changed
+  """
+  for zone, info in state.get("zones", {}).items():
+    if not core.hasZone(zone):
+      continue
+    if info.get("scene", None) is not None and core.hasScene(info["scene"]):
+      core.setZoneScene(zone, info["scene"])
+    if info.get("subzone", None) is not None and core.hasSubZones(zone) and core.hasSubZone(zone, info["subzone"]):
+      core.setSubZone(zone, info["subzone"])
+  for remote, zone in state.get("remotes", {}).items():
+    if zone is not None and remotes.has(remote) and core.hasZone(zone):
+      core.setRemoteZone(remote, zone)
+  router.restoreState(state.get("router", {}))
+  logger.info("Restored state from previous process")
+
+def handOver():
+  """
+  Starts a new process (picking up any changes to code and configuration)
+  which takes over our listening sockets and runtime state. Once it's
+  serving, we stop accepting and ask remotes to reconnect, a few at a time.
+  If it dies or doesn't start serving within HANDOFF_TIMEOUT, we keep going.
+  Until then, calls changing state are refused (see mutating()) since the
+  new process wouldn't know about them.
+  """
+  global handingOver
+  if handingOver:
+    return
+  handingOver = True
+  logger.info("Starting replacement process")
+  remotes.flush()
+  stateFile = handoff.saveState(describeRuntimeState())
+  pid, ready = handoff.spawnSuccessor(sockets, stateFile)
+
+  def failed(reason):
+    global handingOver
+    handingOver = False
+    handoff.discardState(stateFile)
+    logger.error("Replacement process %d %s, still serving", pid, reason)
+
+  def onReady(fd, events):
+    IOLoop.instance().remove_timeout(timeout)
+    IOLoop.instance().remove_handler(fd)
+    started = os.read(fd, 1) != ""
+    os.close(fd)
+    if started:
+      drain(pid)
+    else:
+      os.waitpid(pid, 0)
+      failed("failed to start")
+
+  def onTimeout():
+    IOLoop.instance().remove_handler(ready)
+    os.close(ready)
+    try:
+      os.kill(pid, signal.SIGKILL)
+    except OSError:
+      pass
+    os.waitpid(pid, 0)
+    failed("didn't start serving in time")
+
+  IOLoop.instance().add_handler(ready, onReady, IOLoop.READ)
+  timeout = IOLoop.instance().call_later(HANDOFF_TIMEOUT, onTimeout)
+
+def drain(pid):
+  """Closes websockets (code 1012, service restart) over DRAIN_TIME, then exits"""
+  logger.info("Process %d is now serving, draining", pid)
+  server.stop()
+  ssdp.stop()
+  subscribers = list(event_subscribers)
+  for i, subscriber in enumerate(subscribers):
+    delay = DRAIN_TIME * float(i) / len(subscribers)
+    IOLoop.instance().call_later(delay, subscriber.close, 1012, "Service restart")
+  IOLoop.instance().call_later(DRAIN_TIME + 1, IOLoop.instance().stop)
+
+def measureFirstByte():
+  """
+  Used by --startup-profile, requests / and records how long it took from
+  start until the first byte was received. Then reports and exits.
+  """
+  import urllib2
+  address = cmdline.listen
+  if address in ["", "0.0.0.0"]:
+    address = "127.0.0.1"
+  elif address == "::":
+    address = "::1"
+  if ":" in address:
+    address = "[%s]" % address
+
+  started = time.time()
+  try:
+    urllib2.urlopen("http://%s:%d/" % (address, cmdline.port), timeout=30).read(1)
+  except:
+    logger.exception("Unable to request /")
+  STARTUP.addPhase("first request", time.time() - started)
+  IOLoop.instance().add_callback(reportStartup)
+
+def reportStartup():
+  startupProfile.disable()
+  report = STARTUP.report()
+  STARTUP.log()
+  if report["total-ms"] > STARTUP_TARGET * 1000:
+    logger.warning("Time to first byte was %dms, target is %dms", report["total-ms"], STARTUP_TARGET * 1000)
+  import pstats
+  stats = pstats.Stats(startupProfile, stream=sys.stdout)
+  stats.sort_stats("cumulative").print_stats(40)
+  IOLoop.instance().stop()
 
 """ Finally, launch! """
 if __name__ == "__main__":
   app.debug = False
-  logging.info("multiRemote starting")
+  logger.info("multiRemote starting")
   container = WSGIContainer(app)
-  server = Application([
+  handlers = [
     (r'/events/(.*)', WebSocket),
-    (r'.*', FallbackHandler, dict(fallback=container))
-    ])
-  server.listen(cmdline.port)
-  ssdp.start()
-  logging.info("multiRemote running")
+    (r'/changes', ChangesHandler),
+    (r'/command/([^/]+)', BatchHandler, dict(fallback=container)),
+    (r'/admin/profile', ProfileHandler),
+  ]
+  if cmdline.host is not None:
+    handlers += [
+      (r'/ux', RedirectHandler, dict(url='/ux/')),
+      (r'/ux/(.*)', uxhandler.UXHandler, dict(path=cmdline.host, default_filename='index.html')),
+    ]
+  handlers.append((r'.*', FallbackHandler, dict(fallback=container)))
+  application = MeteredApplication(handlers)
+  state = handoff.inheritedState()
+  if state is not None:
+    with STARTUP.phase("restore state"):
+      restoreRuntimeState(state)
+  with STARTUP.phase("listen"):
+    sockets = handoff.listenSockets(cmdline.port, cmdline.listen)
+    server = HTTPServer(application)
+    server.add_sockets(sockets)
+    ssdp.start()
+  logger.info("multiRemote running")
+  IOLoop.instance().add_callback(STARTUP.log)
+  IOLoop.instance().add_callback(handoff.signalReady)
+  for sig in [signal.SIGUSR2, signal.SIGHUP]:
+    signal.signal(sig, lambda signum, frame: IOLoop.instance().add_callback_from_signal(handOver))
+  # Exit normally so pending writes are flushed
+  signal.signal(signal.SIGTERM, lambda signum, frame: IOLoop.instance().add_callback_from_signal(IOLoop.instance().stop))
+  if cmdline.startup_profile:
+    threading.Thread(target=measureFirstByte, name="StartupProfile").start()
   IOLoop.instance().start()